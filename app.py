@@ -1,44 +1,106 @@
 import asyncio
+import logging
 import os
 
+from dotenv import find_dotenv, load_dotenv
+# до импорта модулей проекта: они читают настройки из окружения при импорте
+load_dotenv(find_dotenv())
+
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 
-from database.engine import create_db, session_maker, drop_db
-from middlewares.db import DataBaseSession
-
-from dotenv import find_dotenv, load_dotenv
-load_dotenv(find_dotenv())
+from database.engine import create_db, session_maker, drop_db, engine, listen_url, pool_stats
+from database.cache import known_users, product_cache
+from database.refdata import refdata
+from middlewares.db import DataBaseSession, ReleaseSessionBeforeRequest
+from middlewares.fileids import TelegramFileIds
+from middlewares.metrics import HandlerMetrics, TelegramRequestMetrics, UpdateMetrics
+from middlewares.throttling import ThrottlingMiddleware
+from utils.cartstore import cart_store
+from utils.coalescer import write_coalescer
+from utils.mailer import Broadcaster
+from utils import metrics
 
 from handlers.user_private import user_private_router
 from handlers.admin_private import admin_private_router
+from handlers.inline_mode import inline_mode_router, inline_results
 
 
 
 ALLOWED_UPDATES = ['message, edited_message']
 
-bot = Bot(token=os.getenv('TOKEN'), default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+
+# TELEGRAM_API_URL позволяет направить бота на локальный Bot API сервер или заглушку для нагрузочных тестов
+api_session = AiohttpSession(api=TelegramAPIServer.from_base(os.getenv('TELEGRAM_API_URL'))) if os.getenv('TELEGRAM_API_URL') else None
+bot = Bot(token=os.getenv('TOKEN'), session=api_session, default=DefaultBotProperties(parse_mode="HTML"))
+broadcaster = Broadcaster(bot=bot, session_pool=session_maker)
+file_ids = TelegramFileIds(session_pool=session_maker)
+background_tasks = set()
+dp = Dispatcher(broadcaster=broadcaster)
 
 dp.include_router(user_private_router)
 dp.include_router(admin_private_router)
+dp.include_router(inline_mode_router)
+
+metrics.instrument_engine(engine)
+metrics.register_stats('db_pool', 'Состояние пула соединений с базой данных.', pool_stats)
+metrics.register_stats('product_cache', 'Состояние кэша продуктов.', product_cache.stats)
+metrics.register_stats('known_users', 'Кэш пользователей, уже сохраненных в базе.', known_users.stats)
+metrics.register_stats('inline_results', 'Кэш результатов inline-режима.', inline_results.stats)
+metrics.register_stats('write_coalescer', 'Пачки записей новых чатов и пользователей.', write_coalescer.stats)
+metrics_server = None
 
 
 async def on_startup(bot):
+    global metrics_server
+    metrics_server = await metrics.start_server()
     # await drop_db()
     await create_db()
+    await refdata.load(session_maker)
+    refdata.listen(listen_url())
+    await broadcaster.resume()
+    cart_store.start(session_maker)
+    write_coalescer.start(session_maker)
+    if os.getenv('IMAGE_CACHE_CHAT_ID'):
+        task = asyncio.create_task(file_ids.warm_up(bot, int(os.getenv('IMAGE_CACHE_CHAT_ID'))))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 
 async def on_shutdown(bot):
+    await broadcaster.stop()
+    await cart_store.stop()
+    await write_coalescer.stop()
+    await refdata.stop()
+    await file_ids.close()
+    logging.info('Статистика пула соединений: %s', pool_stats())
+    if metrics_server is not None:
+        await metrics_server.cleanup()
     print('бот спит')
 
 
-async def main():
+def setup_dispatcher(bot: Bot):
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
+    dp.update.outer_middleware(UpdateMetrics())
+    for router in (user_private_router, admin_private_router):
+        router.message.middleware(HandlerMetrics())
+        router.callback_query.middleware(HandlerMetrics())
+    inline_mode_router.inline_query.middleware(HandlerMetrics())
+    dp.update.middleware(ThrottlingMiddleware())
     dp.update.middleware(DataBaseSession(session_pool=session_maker))
+    bot.session.middleware(ReleaseSessionBeforeRequest())
+    bot.session.middleware(file_ids)
+    bot.session.middleware(TelegramRequestMetrics())
+
+
+async def main():
+    setup_dispatcher(bot)
 
     await bot.delete_webhook(drop_pending_updates=True)
     await bot.delete_my_commands(scope=types.BotCommandScopeAllPrivateChats())
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    CopyMessage,
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageText,
+    GetMe,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, Update, User
+
+
+BENCH_CHAT_TYPE = 'private'
+
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+_callback_ids = itertools.count(1)
+
+
+def _photo(file_id: str) -> list[dict]:
+    return [{'file_id': file_id, 'file_unique_id': file_id[-16:], 'width': 800, 'height': 600}]
+
+
+def _is_url(value) -> bool:
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API, которая ничего не отправляет в Telegram, а записывает вызовы
+    и возвращает правдоподобные ответы. Middleware сессии при этом выполняются как обычно.
+
+    Для фото, отправленных по URL, ответ приходит без file_id, иначе TelegramFileIds
+    заменил бы в базе настоящие URL вымышленными file_id.
+    """
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: int | None = None) -> TelegramType:
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, GetMe):
+            return User.model_validate({'id': bot.id, 'is_bot': True, 'first_name': 'Bench'}, context={'bot': bot})
+        if isinstance(method, SendMediaGroup):
+            return [self._message(bot, method.chat_id, photo=media.media) for media in method.media]
+        if isinstance(method, (SendMessage, CopyMessage)):
+            return self._message(bot, method.chat_id, text=getattr(method, 'text', None))
+        if isinstance(method, SendPhoto):
+            return self._message(bot, method.chat_id, photo=method.photo, caption=method.caption)
+        if isinstance(method, EditMessageMedia) and method.chat_id is not None:
+            return self._message(bot, method.chat_id, method.message_id, photo=method.media.media, caption=method.media.caption)
+        if isinstance(method, (EditMessageText, EditMessageCaption)) and method.chat_id is not None:
+            return self._message(bot, method.chat_id, method.message_id, text=getattr(method, 'text', None))
+        return True
+
+    def _message(self, bot: Bot, chat_id, message_id: int | None = None, text=None, caption=None, photo=None):
+        data = {
+            'message_id': message_id or next(_message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': BENCH_CHAT_TYPE},
+            'text': text,
+            'caption': caption,
+        }
+        if isinstance(photo, str) and not _is_url(photo):
+            data['photo'] = _photo(photo)
+        return Message.model_validate(data, context={'bot': bot})
+
+    async def stream_content(self, url: str, headers: dict[str, Any] | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Bench {user_id}', 'language_code': 'ru'}
+
+
+def message_update(bot: Bot, user_id: int, text: str) -> Update:
+    return Update.model_validate({
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': BENCH_CHAT_TYPE},
+            'from': _user(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else None,
+        },
+    }, context={'bot': bot})
+
+
+def callback_update(bot: Bot, user_id: int, data: str, message_id: int = 1) -> Update:
+    return Update.model_validate({
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_callback_ids)),
+            'from': _user(user_id),
+            'chat_instance': 'bench',
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': BENCH_CHAT_TYPE},
+                'photo': _photo('bench-menu-photo'),
+            },
+        },
+    }, context={'bot': bot})
+
@@ -0,0 +1,238 @@
+"""
+Нагрузочный бенчмарк бота внутри процесса.
+
+Собирает настоящий Dispatcher из app.py с роутерами и middleware, подменяет сессию Bot API
+на FakeSession и прогоняет через dp.feed_update сценарии пользователей против локальной базы
+(переменные DATABASE_* как у бота). Используйте отдельную базу: сценарии пишут в корзины,
+чаты и рассылки, а с --seed-products добавляют тестовые товары.
+
+    python -m benchmarks.run --users 20 --rounds 3 --save benchmarks/baseline.json
+    python -m benchmarks.run --users 20 --rounds 3 --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+# бенчмарк меряет обработку апдейтов, а не ограничения частоты и скорость рассылки
+os.environ.setdefault('TOKEN', '42:bench')
+os.environ.setdefault('BOSS', '1')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('THROTTLE_RATE_FACTOR', '1000000')
+os.environ.setdefault('THROTTLE_DUPLICATE_WINDOW', '0')
+os.environ.setdefault('MAILING_RATE', '100000')
+os.environ.setdefault('MAILING_REPORT_INTERVAL', '3600')
+
+from sqlalchemy import event
+
+import app
+from benchmarks.fakes import FakeSession, callback_update, message_update
+from database.engine import DEFAULT_BANNER_IMAGE, engine, session_maker
+from database.orm_query import orm_product_add, orm_product_get_all_by_category
+from database.refdata import refdata
+from keyboards.inline import MenuCallBack
+
+
+FIRST_USER_ID = 10_000_000
+PERCENTILES = (50, 95, 99)
+
+
+def menu(level: int, menu_name: str, **kwargs) -> str:
+    return MenuCallBack(level=level, menu_name=menu_name, **kwargs).pack()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.queries: dict[str, int] = defaultdict(int)
+        self.elapsed: dict[str, float] = defaultdict(float)
+        self.flow: str | None = None
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        if self.flow is not None:
+            self.queries[self.flow] += 1
+
+    def report(self) -> dict:
+        result = {}
+        for flow, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            result[flow] = {
+                'updates': len(latencies),
+                'updates_per_sec': len(latencies) / self.elapsed[flow] if self.elapsed[flow] else 0.0,
+                **{f'p{p}_ms': _percentile(latencies, p) * 1000 for p in PERCENTILES},
+                'queries_per_update': self.queries[flow] / len(latencies),
+            }
+        return result
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, round(percent / 100 * (len(values) - 1)))]
+
+
+async def feed(recorder: Recorder, flow: str, update):
+    started = time.perf_counter()
+    await app.dp.feed_update(app.bot, update)
+    recorder.latencies[flow].append(time.perf_counter() - started)
+
+
+async def start_flow(recorder: Recorder, user_id: int, catalog: dict):
+    await feed(recorder, 'start', message_update(app.bot, user_id, '/start'))
+
+
+async def catalog_flow(recorder: Recorder, user_id: int, catalog: dict):
+    bot = app.bot
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(0, 'main')))
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(1, 'catalog')))
+    for category, products in catalog.items():
+        for page in range(1, len(products) + 1):
+            await feed(recorder, 'catalog', callback_update(bot, user_id, menu(2, 'catalog', category=category, page=page)))
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(3, 'cart')))
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(5, 'order')))
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(5, 'pickup')))
+    for branch in refdata.branches():
+        await feed(recorder, 'catalog', callback_update(bot, user_id, menu(5, f'pickfrom_{branch.name}')))
+    await feed(recorder, 'catalog', callback_update(bot, user_id, menu(4, 'registration')))
+
+
+async def cart_flow(recorder: Recorder, user_id: int, catalog: dict):
+    bot = app.bot
+    products = [product_id for ids in catalog.values() for product_id in ids][:3]
+    for product_id in products:
+        await feed(recorder, 'cart', callback_update(bot, user_id, menu(2, 'add_to_cart', product_id=product_id)))
+    for product_id in products:
+        for menu_name in ('increment', 'increment', 'decrement'):
+            await feed(recorder, 'cart', callback_update(bot, user_id, menu(3, menu_name, page=1, product_id=product_id)))
+    for product_id in products:
+        await feed(recorder, 'cart', callback_update(bot, user_id, menu(3, 'delete', page=1, product_id=product_id)))
+
+
+FLOWS = {
+    'start': start_flow,
+    'catalog': catalog_flow,
+    'cart': cart_flow,
+}
+
+
+async def mailing_flow(recorder: Recorder, admin_id: int):
+    await feed(recorder, 'mailing', message_update(app.bot, admin_id, 'Общая рассылка'))
+    await feed(recorder, 'mailing', message_update(app.bot, admin_id, 'Бенчмарк рассылки'))
+    started = time.perf_counter()
+    tasks = list(app.broadcaster.tasks.values())
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return time.perf_counter() - started
+
+
+async def load_catalog(seed_products: int) -> dict[int, list[int]]:
+    catalog = {}
+    async with session_maker() as session:
+        for category in refdata.categories():
+            products = await orm_product_get_all_by_category(session, category.id)
+            for number in range(len(products), seed_products):
+                await orm_product_add(session, {
+                    'name': f'Тестовый товар {number + 1}',
+                    'description': 'Товар для бенчмарка',
+                    'price': 100 + number,
+                    'image': DEFAULT_BANNER_IMAGE,
+                    'category': category.id,
+                })
+            if len(products) < seed_products:
+                products = await orm_product_get_all_by_category(session, category.id)
+            if products:
+                catalog[category.id] = sorted(product.id for product in products)
+    return catalog
+
+
+def compare(current: dict, baseline: dict):
+    print(f'\n{"сценарий":<10} {"метрика":<20} {"база":>12} {"сейчас":>12} {"изм.":>8}')
+    for flow, values in current.items():
+        for name, value in values.items():
+            old = baseline.get(flow, {}).get(name)
+            if old is None:
+                continue
+            change = (value - old) / old * 100 if old else 0.0
+            print(f'{flow:<10} {name:<20} {old:>12.2f} {value:>12.2f} {change:>+7.1f}%')
+
+
+def print_report(report: dict):
+    print(f'\n{"сценарий":<10} {"апдейтов":>9} {"апд./сек":>10} {"p50 мс":>9} {"p95 мс":>9} {"p99 мс":>9} {"SQL/апд.":>9}')
+    for flow, r in report.items():
+        print(
+            f'{flow:<10} {r["updates"]:>9} {r["updates_per_sec"]:>10.1f} {r["p50_ms"]:>9.2f} '
+            f'{r["p95_ms"]:>9.2f} {r["p99_ms"]:>9.2f} {r["queries_per_update"]:>9.2f}'
+        )
+
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+
+    app.bot.session = FakeSession(latency=args.api_latency / 1000)
+    app.setup_dispatcher(app.bot)
+    await app.dp.emit_startup(bot=app.bot, **app.dp.workflow_data)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    try:
+        catalog = await load_catalog(args.seed_products)
+        if not catalog:
+            sys.exit('В каталоге нет товаров, запустите с --seed-products N')
+
+        recorder = Recorder()
+        users = [FIRST_USER_ID + number for number in range(args.users)]
+        for flow in args.flows:
+            if flow == 'mailing':
+                continue
+            started = time.perf_counter()
+            recorder.flow = flow
+            for _ in range(args.rounds):
+                await asyncio.gather(*(FLOWS[flow](recorder, user_id, catalog) for user_id in users))
+            recorder.elapsed[flow] = time.perf_counter() - started
+            recorder.flow = None
+
+        mailing_seconds = None
+        if 'mailing' in args.flows:
+            admin_id = int(re.findall(r'\d+', os.environ['BOSS'])[0])
+            recorder.flow = 'mailing'
+            started = time.perf_counter()
+            mailing_seconds = await mailing_flow(recorder, admin_id)
+            recorder.elapsed['mailing'] = time.perf_counter() - started - mailing_seconds
+            recorder.flow = None
+
+        report = recorder.report()
+        if mailing_seconds is not None:
+            report['mailing']['delivery_seconds'] = mailing_seconds
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot, **app.dp.workflow_data)
+        await engine.dispose()
+
+    print_report(report)
+    print(f'\nВызовы Bot API: {dict(app.bot.session.calls)}')
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f'Результаты сохранены в {args.save}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(report, json.load(file))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработки апдейтов бота')
+    parser.add_argument('--users', type=int, default=10, help='число одновременных пользователей')
+    parser.add_argument('--rounds', type=int, default=3, help='сколько раз каждый пользователь проходит сценарий')
+    parser.add_argument('--flows', default='start,catalog,cart,mailing', type=lambda value: value.split(','))
+    parser.add_argument('--seed-products', type=int, default=0, help='добавить товары, чтобы в каждой категории было не меньше N')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, мс')
+    parser.add_argument('--save', help='сохранить результаты в JSON как базовую линию')
+    parser.add_argument('--compare', help='сравнить с сохраненной базовой линией')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
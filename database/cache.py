@@ -0,0 +1,195 @@
+import asyncio
+import functools
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class QueryCache:
+    """
+    Ограниченный LRU-кэш с TTL для результатов orm-запросов.
+
+    Каждая запись помечается тегами (например category:3, product:15), и инвалидация
+    по тегу вытесняет только связанные записи. Счетчик version растет при каждой
+    инвалидации, по нему можно строить производные кэши.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, Any, frozenset[str]]] = OrderedDict()
+        self.tags: dict[str, set[Hashable]] = {}
+        self.inflight: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value, _ = entry
+        if expires < time.monotonic():
+            self._evict(key)
+            return False, None
+        self.entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()):
+        if key in self.entries:
+            self._evict(key)
+        tags = frozenset(tags)
+        self.entries[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            self._evict(next(iter(self.entries)))
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            for key in list(self.tags.get(tag, ())):
+                self._evict(key)
+        self.version += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+        self.version += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+    def _evict(self, key: Hashable):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def cached(self, tags: Callable[..., Iterable[str]]):
+        """
+        Декоратор для orm-функций вида f(session, *args, **kwargs).
+
+        Ключ строится из имени функции и аргументов (кроме session), теги вычисляются
+        вызовом tags(result, *args, **kwargs). Одновременные промахи по одному ключу
+        выполняют запрос один раз. Закэшированные ORM-объекты отсоединяются от сессии,
+        чтобы rollback или close чужой сессии их не затронул.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(session: AsyncSession, *args, **kwargs):
+                key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+                found, value = self.get(key)
+                if found:
+                    self.hits += 1
+                    return value
+                inflight = self.inflight.get(key)
+                if inflight is not None:
+                    try:
+                        value = await asyncio.shield(inflight)
+                        self.hits += 1
+                        return value
+                    except asyncio.CancelledError:
+                        if not inflight.cancelled():
+                            raise
+                    except Exception:
+                        pass
+                self.misses += 1
+                future = asyncio.get_running_loop().create_future()
+                self.inflight[key] = future
+                version = self.version
+                try:
+                    value = await func(session, *args, **kwargs)
+                    _detach(session, value)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    future.set_exception(e)
+                    future.exception()
+                    raise
+                else:
+                    future.set_result(value)
+                    # запись, прочитанная до инвалидации, уже может быть устаревшей
+                    if version == self.version:
+                        self.set(key, value, tags(value, *args, **kwargs))
+                finally:
+                    if self.inflight.get(key) is future:
+                        del self.inflight[key]
+                return value
+            wrapper.cache = self
+            return wrapper
+        return decorator
+
+
+class KnownIds:
+    """
+    Ограниченное LRU-множество идентификаторов, которые точно есть в базе.
+
+    Идентификатор добавляется только после commit, который его записал или подтвердил,
+    поэтому членство означает, что строка существует, и проверку в базе можно пропустить.
+    Промах ничего не утверждает: вызывающий код идет в базу, как без кэша.
+    """
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.ids: OrderedDict[int, None] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, item: int) -> bool:
+        if item in self.ids:
+            self.ids.move_to_end(item)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, item: int):
+        self.ids[item] = None
+        self.ids.move_to_end(item)
+        while len(self.ids) > self.maxsize:
+            self.ids.popitem(last=False)
+
+    def update(self, items: Iterable[int]):
+        for item in items:
+            self.add(item)
+
+    def clear(self):
+        self.ids.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.ids),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+def _detach(session: AsyncSession, value: Any):
+    items = value if isinstance(value, (list, tuple)) else (value,)
+    for item in items:
+        state = inspect(item, raiseerr=False)
+        if state is not None and state.session_id is not None:
+            session.expunge(item)
+
+
+product_cache = QueryCache(
+    maxsize=int(os.getenv('PRODUCT_CACHE_SIZE', 2048)),
+    ttl=float(os.getenv('PRODUCT_CACHE_TTL', 300)),
+)
+known_users = KnownIds(maxsize=int(os.getenv('KNOWN_IDS_SIZE', 100_000)))
@@ -1,35 +1,218 @@
+import hashlib
+import json
+import logging
 import os
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import time
+from uuid import uuid4
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import exc, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from database.models import Based
-from database.orm_query import orm_banner_description_add, orm_categories_create, orm_banner_all_images_create, orm_banner_delete_all, orm_branches_add_all, orm_delete_branches_info, orm_branches_all_images_create
+from database.orm_query import orm_seed_hash_get, orm_seed_reference_data
 
 from common.texts_for_db import categories, description_for_info_pages, currentbranches
 
+
+logger = logging.getLogger(__name__)
+
 DATABASE_HOST = os.getenv("DATABASE_HOST")
 DATABASE_USER = os.getenv("DATABASE_USER")
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
 databaseurl = f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
+# прямое соединение с Postgres для LISTEN, в обход PgBouncer
+DB_LISTEN_URL = os.getenv('DB_LISTEN_URL')
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic.ini')
+# общий ключ advisory lock, под которым реплики по очереди мигрируют схему и заливают начальные данные
+STARTUP_LOCK_KEY = 7_240_001
+
+DEFAULT_BANNER_IMAGE = 'https://img.freepik.com/free-photo/traditional-russian-pelmeni-dumplings-with-meat_114579-35051.jpg'
+DEFAULT_BRANCH_IMAGE = 'https://fastly.4sqi.net/img/general/1398x536/43700824_WZcpm4WrwgH4A7s6BBgcA42GV4lzHalVtAfA5ngwSYo.jpg'
+
+# профили настроек движка, любое значение можно переопределить переменной окружения DB_<НАЗВАНИЕ>
+DB_PROFILES = {
+    'development': {
+        'echo': True,
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_cache_size': 100,
+    },
+    'production': {
+        'echo': False,
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': False,
+        'statement_cache_size': 500,
+    },
+    # PgBouncer в режиме transaction pooling не поддерживает именованные prepared statements
+    'pgbouncer': {
+        'echo': False,
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': False,
+        'statement_cache_size': 0,
+    },
+}
+
+
+def engine_settings() -> dict:
+    profile = os.getenv('DB_PROFILE', 'production')
+    if profile not in DB_PROFILES:
+        raise ValueError(f'Неизвестный профиль DB_PROFILE={profile!r}, доступны: {", ".join(DB_PROFILES)}')
+    settings = dict(DB_PROFILES[profile], profile=profile)
+    for name, default in DB_PROFILES[profile].items():
+        value = os.getenv(f'DB_{name.upper()}')
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            settings[name] = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            settings[name] = int(value)
+    return settings
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который считает выдачи соединений и время ожидания свободного соединения.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_total, pool.wait_max = self.wait_total, self.wait_max
+        return pool
+
 
-engine = create_async_engine(databaseurl, echo=True)
+def build_engine(url: str, settings: dict):
+    statement_cache_size = settings['statement_cache_size']
+    url = make_url(url).update_query_dict({'prepared_statement_cache_size': str(statement_cache_size)})
+    connect_args = {'statement_cache_size': statement_cache_size}
+    if settings['profile'] == 'pgbouncer':
+        connect_args['prepared_statement_name_func'] = lambda: f'__asyncpg_{uuid4()}__'
+    return create_async_engine(
+        url,
+        echo=settings['echo'],
+        poolclass=InstrumentedPool,
+        pool_size=settings['pool_size'],
+        max_overflow=settings['max_overflow'],
+        pool_timeout=settings['pool_timeout'],
+        pool_recycle=settings['pool_recycle'],
+        pool_pre_ping=settings['pool_pre_ping'],
+        connect_args=connect_args,
+    )
+
+
+settings = engine_settings()
+engine = build_engine(databaseurl, settings)
 session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+
+def listen_url() -> str | None:
+    """
+    Возвращает DSN для соединения, которое слушает NOTIFY.
+
+    LISTEN не работает через PgBouncer в режиме transaction pooling, поэтому при профиле
+    pgbouncer нужен DB_LISTEN_URL с прямым адресом Postgres.
+
+    Возвращает:
+        str | None: DSN для asyncpg или None, если при профиле pgbouncer DB_LISTEN_URL не задан.
+    """
+    if DB_LISTEN_URL:
+        url = make_url(DB_LISTEN_URL)
+    elif settings['profile'] == 'pgbouncer':
+        return None
+    else:
+        url = engine.url.set(query={})
+    return url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'checkouts': pool.checkouts,
+        'timeouts': pool.timeouts,
+        'wait_seconds_total': pool.wait_total,
+        'wait_seconds_max': pool.wait_max,
+    }
+
+
 async def create_db():
+    logger.info(
+        'База данных: профиль %s, pool_size=%s, max_overflow=%s, pool_timeout=%s, pool_recycle=%s, '
+        'pool_pre_ping=%s, statement_cache_size=%s, echo=%s',
+        settings['profile'], settings['pool_size'], settings['max_overflow'], settings['pool_timeout'],
+        settings['pool_recycle'], settings['pool_pre_ping'], settings['statement_cache_size'], settings['echo'],
+    )
+    # pg_advisory_xact_lock снимается вместе с транзакцией на том же соединении, поэтому
+    # блокировка работает и через PgBouncer в режиме transaction pooling и не требует второго соединения
     async with engine.begin() as conn:
-        await conn.run_sync(Based.metadata.create_all)
-        
-    async with session_maker() as session:
-        await orm_delete_branches_info(session)
-        await orm_branches_add_all(session, data=currentbranches)
-        # await orm_banner_delete_all(session) # необходимо использовать при добавлении нового баннера
-        await orm_categories_create(session, categories)
-        await orm_banner_description_add(session, description_for_info_pages)
-        await orm_banner_all_images_create(session, 'https://img.freepik.com/free-photo/traditional-russian-pelmeni-dumplings-with-meat_114579-35051.jpg')
-        await orm_branches_all_images_create(session, 'https://fastly.4sqi.net/img/general/1398x536/43700824_WZcpm4WrwgH4A7s6BBgcA42GV4lzHalVtAfA5ngwSYo.jpg')
+        await conn.scalar(select(func.pg_advisory_xact_lock(STARTUP_LOCK_KEY)))
+        await conn.run_sync(_upgrade_schema)
+        await seed_db(conn)
+
+
+def _upgrade_schema(connection):
+    config = Config(ALEMBIC_INI)
+    config.attributes['connection'] = connection
+    command.upgrade(config, 'head')
+
+
+async def seed_db(conn: AsyncConnection):
+    seed = {
+        'categories': categories,
+        'banners': description_for_info_pages,
+        'branches': currentbranches,
+        'banner_image': DEFAULT_BANNER_IMAGE,
+        'branch_image': DEFAULT_BRANCH_IMAGE,
+    }
+    seed_hash = hashlib.sha256(json.dumps(seed, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    # данные пишутся в транзакцию миграций и фиксируются вместе с ней при выходе из create_db
+    async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+        session.info['unit_of_work'] = True
+        if await orm_seed_hash_get(session, 'reference') == seed_hash:
+            logger.info('Начальные данные не изменились, заливка пропущена')
+            return
+        await orm_seed_reference_data(session, name='reference', seed_hash=seed_hash, **seed)
+        logger.info('Начальные данные обновлены')
 
 
 async def drop_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Based.metadata.drop_all)
\ No newline at end of file
+        await conn.run_sync(Based.metadata.drop_all)
+        await conn.execute(text('DROP TABLE IF EXISTS alembic_version'))
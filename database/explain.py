@@ -0,0 +1,237 @@
+"""
+Планы запросов orm_query на синтетических данных.
+
+Внутри одной транзакции заполняет таблицы тестовыми категориями, товарами, пользователями,
+корзинами и чатами, вызывает orm-функции горячих путей, перехватывает их SQL и выполняет
+для каждого запроса EXPLAIN (ANALYZE, BUFFERS). В конце транзакция откатывается, база
+остается без изменений. Seq Scan по большим таблицам помечается, и команда завершается
+с кодом 1, поэтому ее можно запускать в CI после миграций.
+
+    python -m database.explain --products 20000 --users 5000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import timedelta
+
+from dotenv import find_dotenv, load_dotenv
+load_dotenv(find_dotenv())
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.cache import product_cache
+from database.engine import engine
+from database.orm_query import (
+    orm_banner_get,
+    orm_categories_get,
+    orm_branches_get_all,
+    orm_branch_get_by_name,
+    orm_product_get,
+    orm_product_get_all_by_category,
+    orm_product_paginate_by_category,
+    orm_product_search,
+    orm_product_delete,
+    orm_user_add,
+    orm_cart_add,
+    orm_cart_summary,
+    orm_cart_lines_stream,
+    orm_cart_quantities,
+    orm_carts_save,
+    orm_cart_product_reduce,
+    orm_cart_product_delete,
+    orm_id_save,
+    orm_ids_get_batch,
+    orm_mailings_get_unfinished,
+    orm_chats_mark_dead,
+    orm_chats_prune_dead,
+)
+
+
+# справочники остаются маленькими, полный просмотр для них дешевле индекса
+SMALL_TABLES = frozenset({'banner', 'category', 'branches', 'mailings', 'seed_state'})
+SEED_PREFIX = 'EXPLAIN'
+FIRST_USER_ID = 900_000_000
+
+
+class StatementRecorder:
+    def __init__(self):
+        self.statements: list[tuple[str, tuple]] | None = None
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.statements is not None and not executemany:
+            self.statements.append((statement, tuple(parameters or ())))
+
+    def start(self):
+        self.statements = []
+
+    def stop(self) -> list[tuple[str, tuple]]:
+        statements, self.statements = self.statements, None
+        return [(s, p) for s, p in statements if s.lstrip().split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')]
+
+
+async def seed(conn, categories: int, products: int, users: int, chats: int):
+    params = {'prefix': SEED_PREFIX, 'categories': categories, 'products': products, 'users': users,
+              'chats': chats, 'first_user': FIRST_USER_ID,
+              'middle_user': FIRST_USER_ID + users // 2, 'middle_chat': chats // 2}
+    await conn.execute(text("""
+        INSERT INTO category (name, created, updated)
+        SELECT :prefix || ' ' || g, now(), now() FROM generate_series(1, :categories) AS g
+    """), params)
+    await conn.execute(text("""
+        INSERT INTO product (name, description, price, image, category_id, created, updated)
+        SELECT :prefix || ' товар ' || g, 'описание', 100 + g % 900, 'image', c.ids[1 + g % :categories], now(), now()
+        FROM generate_series(1, :products) AS g,
+             (SELECT array_agg(id ORDER BY id) AS ids FROM category WHERE name LIKE :prefix || ' %') AS c
+    """), params)
+    await conn.execute(text("""
+        INSERT INTO "user" (user_id, first_name, created, updated)
+        SELECT :first_user + g, :prefix, now(), now() FROM generate_series(1, :users) AS g
+    """), params)
+    await conn.execute(text("""
+        INSERT INTO cart (user_id, product_id, quantity, created, updated)
+        SELECT u.user_id, p.ids[1 + (u.id * 7 + j) % array_length(p.ids, 1)], 1, now(), now()
+        FROM "user" AS u, generate_series(0, 2) AS j,
+             (SELECT array_agg(id ORDER BY id) AS ids FROM product WHERE name LIKE :prefix || ' %') AS p
+        WHERE u.first_name = :prefix
+        ON CONFLICT DO NOTHING
+    """), params)
+    await conn.execute(text("""
+        INSERT INTO chat_ids (chat_id, status, last_failure, created, updated)
+        SELECT :first_user + g,
+               CASE WHEN g % 10 = 0 THEN 'blocked' ELSE 'active' END,
+               CASE WHEN g % 10 = 0 THEN now() - interval '60 days' END,
+               now(), now()
+        FROM generate_series(1, :chats) AS g
+        ON CONFLICT DO NOTHING
+    """), params)
+    for table in ('category', 'product', '"user"', 'cart', 'chat_ids'):
+        await conn.execute(text(f'ANALYZE {table}'))
+
+    sample = (await conn.execute(text("""
+        SELECT c.user_id, c.product_id, p.category_id,
+               (SELECT count(*) FROM product WHERE category_id = p.category_id) AS category_size,
+               (SELECT name FROM branches ORDER BY id LIMIT 1) AS branch,
+               (SELECT id FROM chat_ids WHERE chat_id > :first_user ORDER BY id OFFSET :middle_chat LIMIT 1) AS chat_cursor
+        FROM cart AS c JOIN product AS p ON p.id = c.product_id
+        WHERE c.user_id = :middle_user
+        ORDER BY c.id LIMIT 1
+    """), params)).one()
+    return sample
+
+
+def scenarios(sample):
+    user_id, product_id, category_id = sample.user_id, sample.product_id, sample.category_id
+    middle_page = max(1, sample.category_size // 2)
+
+    async def stream_cart(session):
+        return [line async for line in orm_cart_lines_stream(session, user_id=user_id)]
+
+    calls = [
+        ('orm_banner_get', lambda s: orm_banner_get(s, 'main')),
+        ('orm_categories_get', lambda s: orm_categories_get(s)),
+        ('orm_branches_get_all', lambda s: orm_branches_get_all(s)),
+        ('orm_product_get', lambda s: orm_product_get(s, product_id)),
+        ('orm_product_get_all_by_category', lambda s: orm_product_get_all_by_category(s, category_id)),
+        ('orm_product_paginate_by_category', lambda s: orm_product_paginate_by_category(s, category_id, page=middle_page)),
+        ('orm_product_paginate_by_category x10', lambda s: orm_product_paginate_by_category(s, category_id, page=max(1, middle_page // 10), per_page=10)),
+        ('orm_product_search', lambda s: orm_product_search(s, 'товар 42', page=1)),
+        ('orm_product_search fuzzy', lambda s: orm_product_search(s, 'тавар', page=1)),
+        ('orm_product_search broad x10', lambda s: orm_product_search(s, 'товар', page=3, per_page=10)),
+        ('orm_user_add', lambda s: orm_user_add(s, user_id=user_id)),
+        ('orm_cart_add', lambda s: orm_cart_add(s, user_id=user_id, product_id=product_id)),
+        ('orm_cart_summary', lambda s: orm_cart_summary(s, user_id=user_id, page=2)),
+        ('orm_cart_lines_stream', stream_cart),
+        ('orm_cart_quantities', lambda s: orm_cart_quantities(s, user_id)),
+        ('orm_carts_save', lambda s: orm_carts_save(s, {user_id: {product_id: 2}})),
+        ('orm_cart_product_reduce', lambda s: orm_cart_product_reduce(s, user_id=user_id, product_id=product_id)),
+        ('orm_cart_product_delete', lambda s: orm_cart_product_delete(s, user_id=user_id, product_id=product_id)),
+        ('orm_id_save', lambda s: orm_id_save(s, chat_id=FIRST_USER_ID + 1)),
+        ('orm_ids_get_batch', lambda s: orm_ids_get_batch(s, after_id=sample.chat_cursor or 0, limit=200)),
+        ('orm_mailings_get_unfinished', lambda s: orm_mailings_get_unfinished(s)),
+        ('orm_chats_mark_dead', lambda s: orm_chats_mark_dead(s, [FIRST_USER_ID + 2], 'blocked')),
+        ('orm_chats_prune_dead', lambda s: orm_chats_prune_dead(s, timedelta(days=30))),
+        ('orm_product_delete', lambda s: orm_product_delete(s, product_id)),
+    ]
+    if sample.branch is not None:
+        calls.insert(3, ('orm_branch_get_by_name', lambda s: orm_branch_get_by_name(s, sample.branch)))
+    return calls
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk(child)
+
+
+def describe(node: dict) -> str:
+    target = node.get('Index Name') or node.get('Relation Name') or ''
+    return f'{node["Node Type"]} {target}'.strip()
+
+
+async def main(args) -> int:
+    recorder = StatementRecorder()
+    problems = 0
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            started = time.perf_counter()
+            sample = await seed(conn, args.categories, args.products, args.users, args.chats)
+            print(f'Тестовые данные созданы за {time.perf_counter() - started:.1f} сек.: категорий {args.categories}, '
+                  f'товаров {args.products}, пользователей {args.users}, чатов {args.chats}\n')
+
+            session = AsyncSession(bind=conn, join_transaction_mode='create_savepoint', expire_on_commit=False)
+            session.info['unit_of_work'] = True
+            for title, call in scenarios(sample):
+                product_cache.clear()
+                recorder.start()
+                await call(session)
+                await session.flush()
+                statements = recorder.stop()
+                print(f'== {title}')
+                for statement, parameters in statements:
+                    result = await conn.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}', parameters)
+                    plan = result.scalar()
+                    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+                    nodes = list(walk(plan['Plan']))
+                    root = plan['Plan']
+                    print(f'   {plan["Execution Time"]:.3f} мс, буферы hit={root.get("Shared Hit Blocks", 0)} '
+                          f'read={root.get("Shared Read Blocks", 0)}: '
+                          + ', '.join(dict.fromkeys(describe(node) for node in nodes if 'Scan' in node['Node Type'])))
+                    for node in nodes:
+                        if node['Node Type'] != 'Seq Scan':
+                            continue
+                        relation = node.get('Relation Name')
+                        if relation in SMALL_TABLES:
+                            continue
+                        problems += 1
+                        print(f'   !! Seq Scan по {relation} ({node.get("Actual Rows")} строк)')
+                        if args.verbose:
+                            print('      ' + ' '.join(statement.split()))
+            await session.close()
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+
+    if problems:
+        print(f'\nНайдено последовательных сканирований больших таблиц: {problems}')
+        return 1
+    print('\nПоследовательных сканирований больших таблиц нет')
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='EXPLAIN (ANALYZE, BUFFERS) для запросов orm_query')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true', help='печатать SQL запросов с Seq Scan')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,4 +1,5 @@
-from sqlalchemy import DateTime, ForeignKey, Numeric, String, Text, BigInteger, func
+from sqlalchemy import Computed, DateTime, ForeignKey, Index, Numeric, String, Text, BigInteger, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -21,11 +22,16 @@ class Category(Based):
     __tablename__ = 'category'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String(150), nullable=False)
+    name: Mapped[str] = mapped_column(String(150), unique=True, nullable=False)
 
 
 class Product(Based):
     __tablename__ = 'product'
+    __table_args__ = (
+        Index('ix_product_category_id_id', 'category_id', 'id'),
+        Index('ix_product_search', 'search', postgresql_using='gin'),
+        Index('ix_product_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -33,6 +39,17 @@ class Product(Based):
     price: Mapped[float] = mapped_column(Numeric(7,2), nullable=False)
     image: Mapped[str] = mapped_column(String(150))
     category_id: Mapped[int] = mapped_column(ForeignKey('category.id', ondelete='CASCADE'), nullable = False)
+    # вычисляется базой, в обычных запросах не загружается
+    search: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+        deferred=True,
+    )
     
     category: Mapped[Category] = relationship(backref='product')
 
@@ -47,6 +64,10 @@ class Banner(Based):
 
 class Cart(Based):
     __tablename__ = 'cart'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'product_id', name='uq_cart_user_product'),
+        Index('ix_cart_product_id', 'product_id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
@@ -58,24 +79,48 @@ class Cart(Based):
     
 class Chat_ids(Based):
     __tablename__ = 'chat_ids'
+    __table_args__ = (
+        Index('ix_chat_ids_status_id', 'status', 'id'),
+        Index('ix_chat_ids_last_failure', 'last_failure'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     chat_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default='active', server_default='active', nullable=False)
+    last_failure: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
 
 
 class Mailings(Based):
     __tablename__ = 'mailings'
     
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    admin_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default='running', nullable=False)
+    cursor: Mapped[int] = mapped_column(default=0, nullable=False)
+    total: Mapped[int] = mapped_column(default=0, nullable=False)
+    sent: Mapped[int] = mapped_column(default=0, nullable=False)
+    failed: Mapped[int] = mapped_column(default=0, nullable=False)
+    finished: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+    # процесс, который ведет рассылку, и время его последней отметки
+    owner: Mapped[str] = mapped_column(String(64), nullable=True)
+    heartbeat: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
 
 
 class Branches(Based):
     __tablename__ = 'branches'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String(150), nullable=False)
+    name: Mapped[str] = mapped_column(String(150), nullable=False, index=True)
     address: Mapped[str] = mapped_column(String(150), nullable=False)
     phone: Mapped[str] = mapped_column(String(13), nullable=True)
     branch_id: Mapped[int] = mapped_column(String(7), unique=True, nullable=False)
     description: Mapped[str] = mapped_column(Text, nullable=True)
-    image: Mapped[str] = mapped_column(String(150), nullable=True)
\ No newline at end of file
+    image: Mapped[str] = mapped_column(String(150), nullable=True)
+
+
+class SeedState(Based):
+    __tablename__ = 'seed_state'
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    hash: Mapped[str] = mapped_column(String(64), nullable=False)
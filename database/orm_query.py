@@ -1,61 +1,92 @@
 import math
-from sqlalchemy import select, update, delete
+from datetime import timedelta
+from decimal import Decimal
+from typing import NamedTuple
+from sqlalchemy import BigInteger, Integer, column, or_, select, update, delete, event, func, tuple_, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import Session, joinedload
 
-from database.models import Banner, Cart, Category, Product, User, Chat_ids, Mailings, Branches
+from database.cache import known_users, product_cache
+from database.models import Banner, Cart, Category, Product, User, Chat_ids, Mailings, Branches, SeedState
+from utils.paginator import QueryPaginator
 
 
-async def orm_banner_description_add(session: AsyncSession, data: dict):
+REFDATA_CHANNEL = 'refdata'
+
+
+class CartSummary(NamedTuple):
+    items: int
+    total: Decimal
+    line: object | None
+
+
+async def orm_commit(session: AsyncSession):
     """
-    Асинхронно добавляет описания баннеров в базу данных.
+    Асинхронно фиксирует изменения orm-функции.
+
+    В режиме unit of work (session.info['unit_of_work'], его включает DataBaseSession)
+    изменения только отправляются в базу через flush, а commit выполняет middleware:
+    ReleaseSessionBeforeRequest перед первым запросом к Bot API или DataBaseSession в конце
+    хендлера. Записи, зафиксированные перед запросом к Bot API, не откатываются, если хендлер
+    упадет позже. Если фиксация нужна немедленно, вызовите session.commit() явно.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
-        data (dict): Словарь, содержащий имена баннеров и их описания.
 
     Возвращает:
         None
     """
-    query = select(Banner)
-    result = await session.execute(query)
-    if result.first():
-        return
-    session.add_all([Banner(name=name,description=description) for name, description in data.items()])
-    await session.commit()
-
+    if session.info.get('unit_of_work'):
+        await session.flush()
+    else:
+        await session.commit()
 
 
-async def orm_branches_all_images_create(session: AsyncSession, default_image: str):
+def orm_on_commit(session: AsyncSession, callback):
     """
-    Асинхронно обновляет URL-адрес изображения по умолчанию в базе данных.
+    Откладывает callback до успешного commit сессии; при rollback он отбрасывается.
 
     Аргументы:
-        session (AsyncSession): Объект AsyncSession для выполнения запроса.
-        default_image (str): Новый URL-адрес изображения.
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        callback (Callable): Функция без аргументов, например инвалидация кэша.
 
     Возвращает:
-        None    
+        None
     """
-    query = update(Branches).where(Branches.image == None).values(image=default_image)
-    await session.execute(query)
-    await session.commit()
+    session.info.setdefault('on_commit', []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_on_commit(session: Session):
+    for callback in session.info.pop('on_commit', ()):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_on_commit(session: Session):
+    session.info.pop('on_commit', None)
+
 
+def _product_list_tags(products, category_id=None):
+    tags = [f'product:{product.id}' for product in products]
+    tags.append(f'category:{int(category_id)}' if category_id is not None else 'products')
+    return tags
 
-async def orm_banner_all_images_create(session: AsyncSession, default_image: str):
+
+async def orm_refdata_notify(session: AsyncSession):
     """
-    Асинхронно обновляет URL-адрес изображения по умолчанию в базе данных.
+    Асинхронно уведомляет все процессы бота об изменении справочников (Banner, Category, Branches).
+
+    NOTIFY доставляется только после фиксации транзакции, поэтому вызывать до commit.
 
     Аргументы:
-        session (AsyncSession): Объект AsyncSession для выполнения запроса.
-        default_image (str): Новый URL-адрес изображения.
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
 
     Возвращает:
-        None    
+        None
     """
-    query = update(Banner).where(Banner.image == None).values(image=default_image)
-    await session.execute(query)
-    await session.commit()
+    await session.execute(select(func.pg_notify(REFDATA_CHANNEL, '')))
 
 
 async def orm_banner_change_image(session: AsyncSession, image: str, name: str):
@@ -72,7 +103,8 @@ async def orm_banner_change_image(session: AsyncSession, image: str, name: str):
     """
     query = update(Banner).where(Banner.name == name).values(image=image)
     await session.execute(query)
-    await session.commit()
+    await orm_refdata_notify(session)
+    await orm_commit(session)
 
 
 
@@ -144,25 +176,6 @@ async def orm_categories_get_all(session: AsyncSession):
     return result
 
               
-async def orm_categories_create(session: AsyncSession, categories: list):
-    """
-    Асинхронно добавляет категории в базу данных.
-
-    Аргументы:
-        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
-        categories (list): Список категорий для добавления.
-
-    Возвращает:
-        None
-    """
-    query = select(Category)
-    result = await session.execute(query)
-    if result.first():
-        return
-    session.add_all([Category(name=name) for name in categories])
-    await session.commit()
-
-
 async def orm_product_add(session: AsyncSession, data: dict):
     """
     Асинхронно добавляет продукт в базу данных.
@@ -183,9 +196,11 @@ async def orm_product_add(session: AsyncSession, data: dict):
 
     )
     session.add(someobj)
-    await session.commit()
+    orm_on_commit(session, lambda: product_cache.invalidate(f'category:{int(data["category"])}', 'products'))
+    await orm_commit(session)
 
 
+@product_cache.cached(tags=_product_list_tags)
 async def orm_product_get_by_category(session: AsyncSession, category_id: int):
     """
     Асинхронно извлекает продукты из базы данных по идентификатору категории.
@@ -203,6 +218,7 @@ async def orm_product_get_by_category(session: AsyncSession, category_id: int):
     return result.scalars().all()
 
 
+@product_cache.cached(tags=lambda product, product_id: [f'product:{product_id}'])
 async def orm_product_get(session: AsyncSession, product_id: int):
     """
     Асинхронно извлекает продукт из базы данных по его идентификатору.
@@ -218,6 +234,50 @@ async def orm_product_get(session: AsyncSession, product_id: int):
     result = await session.execute(query)
     return result.scalar()
 
+async def orm_products_get_many(session: AsyncSession, product_ids: list[int]):
+    """
+    Асинхронно извлекает несколько продуктов по идентификаторам.
+
+    Продукты из product_cache берутся без запроса, остальные загружаются одним
+    SELECT ... WHERE id IN и кладутся в кэш под теми же ключами, что и у orm_product_get.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для выполнения запроса.
+        product_ids (list): Идентификаторы продуктов.
+
+    Возвращает:
+        dict: Словарь {product_id: Product}; для удаленных продуктов значение None.
+    """
+    products, missing = {}, []
+    for product_id in product_ids:
+        found, product = product_cache.get(_product_get_key(product_id))
+        if found:
+            product_cache.hits += 1
+            products[product_id] = product
+        else:
+            missing.append(product_id)
+    if not missing:
+        return products
+    product_cache.misses += len(missing)
+    version = product_cache.version
+    result = await session.execute(select(Product).where(Product.id.in_(missing)))
+    loaded = {product.id: product for product in result.scalars().all()}
+    for product in loaded.values():
+        session.expunge(product)
+    for product_id in missing:
+        products[product_id] = loaded.get(product_id)
+        # запись, прочитанная до инвалидации, уже может быть устаревшей
+        if version == product_cache.version:
+            product_cache.set(_product_get_key(product_id), products[product_id], [f'product:{product_id}'])
+    return products
+
+
+def _product_get_key(product_id: int):
+    # ключ, под которым QueryCache.cached хранит orm_product_get(session, product_id)
+    return (orm_product_get.__qualname__, (product_id,), ())
+
+
+@product_cache.cached(tags=_product_list_tags)
 async def orm_product_get_all(session: AsyncSession):
     """
     Асинхронно извлекает все продукты из базы данных.
@@ -234,6 +294,7 @@ async def orm_product_get_all(session: AsyncSession):
     return result.scalars().all()
 
 
+@product_cache.cached(tags=_product_list_tags)
 async def orm_product_get_all_by_category(session: AsyncSession, category_id: int):
     """
     Асинхронно извлекает все продукты из базы данных по идентификатору категории.
@@ -251,6 +312,95 @@ async def orm_product_get_all_by_category(session: AsyncSession, category_id: in
 
 
 
+async def orm_product_paginate_by_category(session: AsyncSession, category_id: int, page: int, per_page: int = 1):
+    """
+    Асинхронно извлекает одну страницу продуктов категории запросом LIMIT/OFFSET.
+
+    Общее число продуктов берется из закэшированного COUNT, поэтому стоимость страницы
+    не зависит от размера категории.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для выполнения запроса.
+        category_id (int): Идентификатор категории.
+        page (int): Номер страницы, начиная с 1.
+        per_page (int): Количество продуктов на странице. По умолчанию 1.
+
+    Возвращает:
+        QueryPaginator: Пагинатор с продуктами текущей страницы.
+    """
+    category_id = int(category_id)
+    query = select(Product).where(Product.category_id == category_id).order_by(Product.id)
+    return await QueryPaginator.create(
+        session,
+        query,
+        page=page,
+        per_page=per_page,
+        cache=product_cache,
+        cache_key=('product_count', category_id),
+        cache_tags=(f'category:{category_id}', 'products'),
+    )
+
+
+async def orm_product_search(session: AsyncSession, text: str, page: int, per_page: int = 1):
+    """
+    Асинхронно ищет продукты по названию и описанию и возвращает страницу результатов.
+
+    Совпадения ищутся полнотекстово по Product.search (русский стемминг, индекс GIN)
+    и нечетко по триграммам названия (индекс gin_trgm_ops), чтобы находить слова с опечатками.
+    Ранжируются все совпадения по сумме ts_rank_cd и similarity, число найденных считается
+    по тому же условию без ограничения и кэшируется до изменения каталога.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для выполнения запроса.
+        text (str): Поисковый запрос.
+        page (int): Номер страницы, начиная с 1.
+        per_page (int): Количество продуктов на странице. По умолчанию 1.
+
+    Возвращает:
+        QueryPaginator: Пагинатор с продуктами текущей страницы.
+    """
+    return await QueryPaginator.create(
+        session,
+        _product_search_query(text),
+        page=page,
+        per_page=per_page,
+        cache=product_cache,
+        cache_key=('product_search', text),
+        cache_tags=('products',),
+    )
+
+
+async def orm_product_search_top(session: AsyncSession, text: str, limit: int):
+    """
+    Асинхронно возвращает первые limit результатов поиска одним запросом, без подсчета общего числа.
+    Для пустого запроса возвращает последние добавленные продукты.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для выполнения запроса.
+        text (str): Поисковый запрос.
+        limit (int): Максимальное количество продуктов.
+
+    Возвращает:
+        list: Список продуктов в порядке релевантности.
+    """
+    if text:
+        query = _product_search_query(text)
+    else:
+        query = select(Product).order_by(Product.id.desc())
+    result = await session.execute(query.limit(limit))
+    return result.scalars().all()
+
+
+def _product_search_query(text: str):
+    tsquery = func.websearch_to_tsquery('russian', text)
+    rank = func.ts_rank_cd(Product.search, tsquery) + func.similarity(Product.name, text)
+    return (
+        select(Product)
+        .where(or_(Product.search.bool_op('@@')(tsquery), Product.name.bool_op('%')(text)))
+        .order_by(rank.desc(), Product.id)
+    )
+
+
 async def orm_product_update(session: AsyncSession, product_id: int, data: dict):
     """
     Асинхронно обновляет данные продукта в базе данных.
@@ -275,13 +425,16 @@ async def orm_product_update(session: AsyncSession, product_id: int, data: dict)
         )
     )
     await session.execute(query)
-    await session.commit()
+    # старая категория вытесняется по тегу product:id, которым помечены ее списки
+    orm_on_commit(session, lambda: product_cache.invalidate(f'product:{product_id}', f'category:{int(data["category"])}', 'products'))
+    await orm_commit(session)
 
 
 async def orm_product_delete(session: AsyncSession, product_id: int):
     query = delete(Product).where(Product.id == product_id)
     await session.execute(query)
-    await session.commit()
+    orm_on_commit(session, lambda: product_cache.invalidate(f'product:{product_id}', 'products'))
+    await orm_commit(session)
 
 
 async def orm_user_add(
@@ -292,7 +445,10 @@ async def orm_user_add(
         phone: str | None = None,
         ):
     """
-    Асинхронно добавляет пользователя в базу данных.
+    Асинхронно добавляет пользователя в базу данных, если его там еще нет.
+
+    Пользователи из known_users пропускаются без запроса, остальные добавляются
+    через INSERT ... ON CONFLICT DO NOTHING и попадают в known_users после commit.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
@@ -304,25 +460,43 @@ async def orm_user_add(
     Возвращает:
         None
     """
-    query = select(User).where(User.user_id == user_id)
-    result = await session.execute(query)
-    if result.first() is None:
-        session.add(
-            User(
-                user_id = user_id,
-                first_name = first_name,
-                last_name = last_name,
-                phone = phone,
-            )
-        )
-        await session.commit()
-    else:
-        print('Такой пользователь уже существует')
+    if user_id in known_users:
+        return
+    query = (
+        insert(User)
+        .values(user_id=user_id, first_name=first_name, last_name=last_name, phone=phone)
+        .on_conflict_do_nothing(index_elements=[User.user_id])
+    )
+    await session.execute(query)
+    orm_on_commit(session, lambda: known_users.add(user_id))
+    await orm_commit(session)
+
+
+async def orm_users_add_many(session: AsyncSession, users: list[dict]):
+    """
+    Асинхронно добавляет пачку пользователей одним запросом INSERT ... ON CONFLICT DO NOTHING.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        users (list): Словари с ключами user_id, first_name, last_name, phone; user_id не повторяются.
+
+    Возвращает:
+        None
+    """
+    if not users:
+        return
+    query = insert(User).values(users).on_conflict_do_nothing(index_elements=[User.user_id])
+    await session.execute(query)
+    orm_on_commit(session, lambda: known_users.update(user['user_id'] for user in users))
+    await orm_commit(session)
 
 
 async def orm_cart_add(session: AsyncSession, user_id: int, product_id: int):
     """
-    Асинхронно добавляет продукт в корзину пользователя.
+    Асинхронно добавляет продукт в корзину пользователя или увеличивает его количество на 1.
+
+    Выполняется одним запросом INSERT ... ON CONFLICT DO UPDATE, поэтому одновременные
+    нажатия не создают дубликатов и не теряют обновлений.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
@@ -330,22 +504,20 @@ async def orm_cart_add(session: AsyncSession, user_id: int, product_id: int):
         product_id (int): Идентификатор продукта.
 
     Возвращает:
-        Cart: Объект Cart, если продукт добавлен в корзину, в противном случае возвращает None.
+        int: Количество продукта в корзине после добавления.
     """
-    query = select(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id)
-    cart = await session.execute(query)
-    cart = cart.scalar()
-    if cart:
-        cart.quantity += 1
-        await session.commit()
-        return cart
-    else:
-        session.add(Cart(
-            user_id = user_id,
-            product_id = product_id,
-            quantity = 1
-        ))
-        await session.commit()
+    query = (
+        insert(Cart)
+        .values(user_id=user_id, product_id=product_id, quantity=1)
+        .on_conflict_do_update(
+            index_elements=[Cart.user_id, Cart.product_id],
+            set_={'quantity': Cart.quantity + 1, 'updated': func.now()},
+        )
+        .returning(Cart.quantity)
+    )
+    quantity = await session.scalar(query)
+    await orm_commit(session)
+    return quantity
 
 
 async def orm_cart_delete(session: AsyncSession, user_id: int, product_id: int):
@@ -362,7 +534,7 @@ async def orm_cart_delete(session: AsyncSession, user_id: int, product_id: int):
     """
     query = delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id)
     await session.execute(query)
-    await session.commit()
+    await orm_commit(session)
 
 
 async def orm_cart_by_user(session: AsyncSession, user_id: int):
@@ -381,6 +553,121 @@ async def orm_cart_by_user(session: AsyncSession, user_id: int):
     return result.scalars().all()
 
 
+def _cart_lines(user_id: int):
+    return (
+        select(
+            Cart.product_id,
+            Cart.quantity,
+            Product.name,
+            Product.price,
+            Product.image,
+            (Cart.quantity * Product.price).label('line_total'),
+            func.row_number().over(order_by=Cart.id).label('position'),
+            func.count().over().label('item_count'),
+            func.sum(Cart.quantity * Product.price).over().label('total'),
+        )
+        .join(Product, Product.id == Cart.product_id)
+        .where(Cart.user_id == user_id)
+    )
+
+
+async def orm_cart_summary(session: AsyncSession, user_id: int, page: int):
+    """
+    Асинхронно возвращает сводку корзины одним запросом: число позиций, итоговую сумму
+    и одну позицию для текущей страницы вместе с данными продукта.
+
+    Если страница больше числа позиций, возвращается последняя позиция.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        user_id (int): Идентификатор пользователя.
+        page (int): Номер позиции в корзине, начиная с 1.
+
+    Возвращает:
+        CartSummary: Число позиций, сумма (Decimal) и строка позиции (product_id, quantity,
+        name, price, image, line_total, position) или None для пустой корзины.
+    """
+    lines = _cart_lines(user_id).subquery()
+    query = select(lines).where(lines.c.position == func.least(page, lines.c.item_count))
+    result = await session.execute(query)
+    line = result.first()
+    if line is None:
+        return CartSummary(items=0, total=Decimal('0.00'), line=None)
+    return CartSummary(items=line.item_count, total=line.total, line=line)
+
+
+async def orm_cart_lines_stream(session: AsyncSession, user_id: int):
+    """
+    Асинхронно выдает позиции корзины по одной, не загружая объекты Cart и Product целиком.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        user_id (int): Идентификатор пользователя.
+
+    Возвращает:
+        AsyncIterator: Строки (product_id, quantity, name, price, image, line_total, position,
+        item_count, total), где total — итоговая сумма корзины.
+    """
+    result = await session.stream(_cart_lines(user_id).order_by(Cart.id))
+    async for line in result:
+        yield line
+
+
+async def orm_cart_quantities(session: AsyncSession, user_id: int):
+    """
+    Асинхронно возвращает количества продуктов в корзине пользователя в порядке добавления.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        user_id (int): Идентификатор пользователя.
+
+    Возвращает:
+        dict: Словарь {product_id: quantity}.
+    """
+    query = select(Cart.product_id, Cart.quantity).where(Cart.user_id == user_id).order_by(Cart.id)
+    result = await session.execute(query)
+    return dict(result.all())
+
+
+async def orm_carts_save(session: AsyncSession, carts: dict[int, dict[int, int]]):
+    """
+    Асинхронно записывает полное содержимое корзин нескольких пользователей двумя запросами:
+    удаляет позиции, которых больше нет, и вставляет или обновляет остальные одним INSERT ... ON CONFLICT.
+
+    Позиции удаленных продуктов и пользователей пропускаются.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        carts (dict): Словарь {user_id: {product_id: quantity}}.
+
+    Возвращает:
+        None
+    """
+    rows = [(user_id, product_id, quantity) for user_id, cart in carts.items() for product_id, quantity in cart.items()]
+    query = delete(Cart).where(Cart.user_id.in_(list(carts)))
+    if rows:
+        query = query.where(tuple_(Cart.user_id, Cart.product_id).not_in([row[:2] for row in rows]))
+    await session.execute(query)
+    if rows:
+        data = values(
+            column('user_id', BigInteger), column('product_id', Integer), column('quantity', Integer), name='rows',
+        ).data(rows)
+        query = insert(Cart).from_select(
+            ['user_id', 'product_id', 'quantity'],
+            select(data.c.user_id, data.c.product_id, data.c.quantity)
+            .where(
+                select(Product.id).where(Product.id == data.c.product_id).exists(),
+                select(User.id).where(User.user_id == data.c.user_id).exists(),
+            ),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[Cart.user_id, Cart.product_id],
+            set_={'quantity': query.excluded.quantity, 'updated': func.now()},
+        )
+        await session.execute(query)
+    await orm_commit(session)
+
+
 async def orm_cart_product_delete(session: AsyncSession, user_id: int, product_id: int):
     """
     Асинхронно удаляет продукт из корзины пользователя.
@@ -395,13 +682,17 @@ async def orm_cart_product_delete(session: AsyncSession, user_id: int, product_i
     """
     query = delete(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id)
     await session.execute(query)
-    await session.commit()  
+    await orm_commit(session)  
 
 
 
 async def orm_cart_product_reduce(session: AsyncSession, user_id: int, product_id: int):
     """
-    Асинхронно уменьшает количество продукта в корзине пользователя.
+    Асинхронно уменьшает количество продукта в корзине пользователя, удаляя позицию на последней единице.
+
+    UPDATE ... RETURNING безусловно уменьшает количество и блокирует строку, поэтому одновременное
+    уменьшение дождется блокировки и применится к новому значению. Если количество дошло до нуля,
+    позиция удаляется вторым запросом в той же транзакции, пока строка еще заблокирована.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
@@ -409,25 +700,29 @@ async def orm_cart_product_reduce(session: AsyncSession, user_id: int, product_i
         product_id (int): Идентификатор продукта.
 
     Возвращает:
-        bool: True, если количество продукта уменьшено, False в противном случае.
+        bool: True, если продукт остался в корзине, False, если позиция удалена или ее не было.
     """
-    query = select(Cart).where(Cart.user_id == user_id, Cart.product_id == product_id)
-    cart = await session.execute(query)
-    cart = cart.scalar()
-    if not cart:
-        return
-    if cart.quantity > 1:
-        cart.quantity -= 1
-        await session.commit()
-        return True
-    else:
-        await orm_cart_product_delete(session, user_id, product_id)
-        await session.commit()
-        return False
+    position = (Cart.user_id == user_id, Cart.product_id == product_id)
+    query = (
+        update(Cart)
+        .where(*position)
+        .values(quantity=Cart.quantity - 1)
+        .returning(Cart.quantity)
+    )
+    quantity = await session.scalar(query)
+    if quantity is not None and quantity <= 0:
+        await session.execute(delete(Cart).where(*position, Cart.quantity <= 0))
+    await orm_commit(session)
+    return bool(quantity and quantity > 0)
 
 async def orm_id_save(session: AsyncSession, chat_id: int):
     """
-    Асинхронно сохраняет идентификатор чата в базу данных.
+    Асинхронно сохраняет идентификатор чата в базу данных и снова делает его активным.
+
+    Чат записывается одним INSERT ... ON CONFLICT DO UPDATE, который меняет только
+    недоступные чаты, для активного чата запись не выполняется. Чаты не кэшируются
+    в процессе: рассылка на любой реплике может пометить чат недоступным, и кэш другой
+    реплики пропустил бы его повторную активацию.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
@@ -436,14 +731,42 @@ async def orm_id_save(session: AsyncSession, chat_id: int):
     Возвращает:
         None
     """
-    query = select(Chat_ids).where(Chat_ids.chat_id == chat_id)
-    result = await session.execute(query)
-    result = result.scalar()
-    if not result:
-        session.add(Chat_ids(chat_id=chat_id))
-    else:
-        pass
-    await session.commit()
+    query = (
+        insert(Chat_ids)
+        .values(chat_id=chat_id)
+        .on_conflict_do_update(
+            index_elements=[Chat_ids.chat_id],
+            set_={'status': 'active', 'last_failure': None, 'updated': func.now()},
+            where=Chat_ids.status != 'active',
+        )
+    )
+    await session.execute(query)
+    await orm_commit(session)
+
+async def orm_ids_save_many(session: AsyncSession, chat_ids: list[int]):
+    """
+    Асинхронно сохраняет пачку идентификаторов чатов одним запросом, как orm_id_save.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        chat_ids (list): Идентификаторы чатов без повторов.
+
+    Возвращает:
+        None
+    """
+    if not chat_ids:
+        return
+    query = (
+        insert(Chat_ids)
+        .values([{'chat_id': chat_id} for chat_id in chat_ids])
+        .on_conflict_do_update(
+            index_elements=[Chat_ids.chat_id],
+            set_={'status': 'active', 'last_failure': None, 'updated': func.now()},
+            where=Chat_ids.status != 'active',
+        )
+    )
+    await session.execute(query)
+    await orm_commit(session)
 
 async def orm_get_mailings(session: AsyncSession):
     """
@@ -461,21 +784,135 @@ async def orm_get_mailings(session: AsyncSession):
 
 async def orm_mailings_add(session: AsyncSession, data: dict):
     """
-    Асинхронно добавляет рассылку в базу данных.
+    Асинхронно создает задание на рассылку в базе данных.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
-        data (dict): Словарь с данными рассылки.
+        data (dict): Словарь с данными рассылки (text, admin_chat_id, owner).
 
     Возвращает:
-        None
+        Mailings: Созданное задание с зафиксированным числом получателей.
     """
-    query = select(Mailings)
+    total = await session.scalar(select(func.count()).select_from(Chat_ids).where(Chat_ids.status == 'active'))
+    mailing = Mailings(
+        text=data['text'],
+        admin_chat_id=data['admin_chat_id'],
+        status='running',
+        cursor=0,
+        total=total,
+        sent=0,
+        failed=0,
+        owner=data.get('owner'),
+        heartbeat=func.now() if data.get('owner') else None,
+    )
+    session.add(mailing)
+    await orm_commit(session)
+    return mailing
+
+
+async def orm_mailing_get(session: AsyncSession, mailing_id: int):
+    """
+    Асинхронно возвращает задание на рассылку по его идентификатору.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        mailing_id (int): Идентификатор рассылки.
+
+    Возвращает:
+        Mailings: Объект Mailings, если рассылка найдена, в противном случае None.
+    """
+    query = select(Mailings).where(Mailings.id == mailing_id)
     result = await session.execute(query)
-    if result.first():
-        return
-    session.add_all(Mailings(name=name) for name in data.values())
-    await session.commit()
+    return result.scalar()
+
+
+async def orm_mailings_get_unfinished(session: AsyncSession):
+    """
+    Асинхронно возвращает незавершенные рассылки (например, прерванные перезапуском бота).
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+
+    Возвращает:
+        list: Список рассылок со статусом running.
+    """
+    query = select(Mailings).where(Mailings.status == 'running').order_by(Mailings.id)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def orm_mailing_claim(session: AsyncSession, mailing_id: int, owner: str, stale_after: timedelta):
+    """
+    Асинхронно закрепляет незавершенную рассылку за процессом одним UPDATE ... RETURNING.
+
+    Рассылку можно занять, если у нее нет владельца или владелец не отмечался
+    дольше stale_after (процесс упал или потерял связь с базой).
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        mailing_id (int): Идентификатор рассылки.
+        owner (str): Идентификатор процесса.
+        stale_after (timedelta): Через сколько без отметок владелец считается пропавшим.
+
+    Возвращает:
+        bool: True, если рассылка теперь принадлежит owner.
+    """
+    query = (
+        update(Mailings)
+        .where(
+            Mailings.id == mailing_id,
+            Mailings.status == 'running',
+            or_(
+                Mailings.owner == None,
+                Mailings.owner == owner,
+                Mailings.heartbeat < func.now() - stale_after,
+            ),
+        )
+        .values(owner=owner, heartbeat=func.now())
+        .returning(Mailings.id)
+    )
+    claimed = (await session.execute(query)).scalar() is not None
+    await orm_commit(session)
+    return claimed
+
+
+async def orm_mailing_progress_save(
+        session: AsyncSession,
+        mailing_id: int,
+        cursor: int,
+        sent: int,
+        failed: int,
+        status: str | None = None,
+        owner: str | None = None,
+        ):
+    """
+    Асинхронно сохраняет прогресс рассылки: курсор по получателям и счетчики.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        mailing_id (int): Идентификатор рассылки.
+        cursor (int): Последний обработанный Chat_ids.id.
+        sent (int): Количество доставленных сообщений.
+        failed (int): Количество неудачных отправок.
+        status (str): Новый статус рассылки. По умолчанию статус не меняется.
+        owner (str): Процесс, который ведет рассылку. Если указан, прогресс сохраняется
+            только пока рассылка принадлежит ему, и обновляется отметка heartbeat.
+
+    Возвращает:
+        bool: False, если рассылку уже занял другой процесс.
+    """
+    values = dict(cursor=cursor, sent=sent, failed=failed)
+    if status is not None:
+        values['status'] = status
+        if status != 'running':
+            values['finished'] = func.now()
+    query = update(Mailings).where(Mailings.id == mailing_id)
+    if owner is not None:
+        query = query.where(Mailings.owner == owner)
+        values['heartbeat'] = func.now()
+    result = await session.execute(query.values(**values))
+    await orm_commit(session)
+    return result.rowcount > 0
 
 
 async def orm_ids_get(session: AsyncSession):
@@ -486,26 +923,76 @@ async def orm_ids_get(session: AsyncSession):
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
 
     Возвращает:
-        list: Список идентификаторов чатов.
+        list: Список идентификаторов живых чатов.
     """
-    query = select(Chat_ids)
+    query = select(Chat_ids).where(Chat_ids.status == 'active')
     result = await session.execute(query)
     return result.scalars().all()
 
 
-async def orm_banner_delete_all(session: AsyncSession):
+async def orm_ids_get_batch(session: AsyncSession, after_id: int, limit: int):
+    """
+    Асинхронно возвращает очередную порцию получателей рассылки после курсора.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        after_id (int): Chat_ids.id, после которого начинается порция.
+        limit (int): Максимальный размер порции.
+
+    Возвращает:
+        list: Список пар (id, chat_id), упорядоченных по id.
+    """
+    query = (
+        select(Chat_ids.id, Chat_ids.chat_id)
+        .where(Chat_ids.id > after_id, Chat_ids.status == 'active')
+        .order_by(Chat_ids.id)
+        .limit(limit)
+    )
+    result = await session.execute(query)
+    return result.all()
+
+
+async def orm_chats_mark_dead(session: AsyncSession, chat_ids: list[int], status: str):
     """
-    Асинхронно удаляет все баннеры из базы данных.
+    Асинхронно помечает чаты как недоступные одним запросом (бот заблокирован, аккаунт удален и тд.).
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        chat_ids (list): Список идентификаторов чатов.
+        status (str): Причина недоступности (blocked, deactivated, not_found).
 
     Возвращает:
         None
     """
-    query = delete(Banner)
+    if not chat_ids:
+        return
+    query = (
+        update(Chat_ids)
+        .where(Chat_ids.chat_id.in_(chat_ids))
+        .values(status=status, last_failure=func.now())
+    )
     await session.execute(query)
-    await session.commit()
+    await orm_commit(session)
+
+
+async def orm_chats_prune_dead(session: AsyncSession, older_than: timedelta):
+    """
+    Асинхронно удаляет чаты, недоступные дольше заданного срока.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        older_than (timedelta): Сколько времени чат должен быть недоступен перед удалением.
+
+    Возвращает:
+        int: Количество удаленных чатов.
+    """
+    query = delete(Chat_ids).where(
+        Chat_ids.status != 'active',
+        Chat_ids.last_failure < func.now() - older_than,
+    )
+    result = await session.execute(query)
+    await orm_commit(session)
+    return result.rowcount
 
 
 async def orm_user_reg_add(session: AsyncSession, user_id: int, first_name: str, last_name: str, phone: str):
@@ -532,28 +1019,9 @@ async def orm_user_reg_add(session: AsyncSession, user_id: int, first_name: str,
             last_name = last_name,
             phone = phone,
         ))
-    await session.commit()
-
-
+    orm_on_commit(session, lambda: known_users.add(user_id))
+    await orm_commit(session)
 
-async def orm_branches_add_all(session: AsyncSession, data: list[dict,dict]):
-    """
-    Асинхронно добавляет все филиалы в базу данных.
-
-    Аргументы:
-        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
-        data (dict): Словарь с данными филиалов.
-
-    Возвращает:
-        None
-    """
-    query = select(Branches)
-    result = await session.execute(query)
-    if result.first():
-        return
-    for pos in data:
-        session.add(Branches(name=pos['name'], address=pos['address'], phone=pos['phone'],branch_id=pos['branch_id'],description=pos['description']))
-        await session.commit()
 
 
 async def orm_branches_get_all(session: AsyncSession):
@@ -586,16 +1054,141 @@ async def orm_branch_get_by_name(session: AsyncSession, name: str):
     result = await session.execute(query)
     return result.scalars().first()
 
-async def orm_delete_branches_info(session: AsyncSession):
-    query = delete(Branches)
-    await session.execute(query)
-    await session.commit()
+async def orm_seed_hash_get(session: AsyncSession, name: str):
     """
-    Асинхронно удаляет все филиалы из базы данных.
+    Асинхронно возвращает хэш последнего примененного набора начальных данных.
 
     Аргументы:
         session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        name (str): Название набора данных.
+
+    Возвращает:
+        str: Хэш набора или None, если набор еще не применялся.
+    """
+    query = select(SeedState.hash).where(SeedState.name == name)
+    return await session.scalar(query)
+
+
+async def orm_seed_reference_data(
+        session: AsyncSession,
+        name: str,
+        seed_hash: str,
+        categories: list,
+        banners: dict,
+        branches: list[dict],
+        banner_image: str,
+        branch_image: str,
+        ):
+    """
+    Асинхронно применяет начальные данные массовыми upsert-запросами и запоминает их хэш.
+
+    Категории добавляются, если их еще нет; описания баннеров и данные филиалов обновляются;
+    филиалы, которых больше нет в наборе, удаляются. Уже загруженные изображения сохраняются,
+    изображения по умолчанию ставятся только там, где их нет.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        name (str): Название набора данных.
+        seed_hash (str): Хэш набора данных.
+        categories (list): Названия категорий.
+        banners (dict): Имена баннеров и их описания.
+        branches (list): Словари с данными филиалов.
+        banner_image (str): Изображение баннера по умолчанию.
+        branch_image (str): Изображение филиала по умолчанию.
 
     Возвращает:
         None
-    """
\ No newline at end of file
+    """
+    await session.execute(
+        insert(Category)
+        .values([{'name': category} for category in categories])
+        .on_conflict_do_nothing(index_elements=[Category.name])
+    )
+
+    banners_insert = insert(Banner).values(
+        [{'name': banner, 'description': description, 'image': banner_image} for banner, description in banners.items()]
+    )
+    await session.execute(
+        banners_insert.on_conflict_do_update(
+            index_elements=[Banner.name],
+            set_={'description': banners_insert.excluded.description, 'updated': func.now()},
+        )
+    )
+    await session.execute(update(Banner).where(Banner.image == None).values(image=banner_image))
+
+    branches_insert = insert(Branches).values([
+        {
+            'name': branch['name'],
+            'address': branch['address'],
+            'phone': branch['phone'],
+            'branch_id': branch['branch_id'],
+            'description': branch['description'],
+            'image': branch_image,
+        }
+        for branch in branches
+    ])
+    await session.execute(
+        branches_insert.on_conflict_do_update(
+            index_elements=[Branches.branch_id],
+            set_={
+                'name': branches_insert.excluded.name,
+                'address': branches_insert.excluded.address,
+                'phone': branches_insert.excluded.phone,
+                'description': branches_insert.excluded.description,
+                'updated': func.now(),
+            },
+        )
+    )
+    await session.execute(delete(Branches).where(Branches.branch_id.not_in([branch['branch_id'] for branch in branches])))
+    await session.execute(update(Branches).where(Branches.image == None).values(image=branch_image))
+
+    seed_insert = insert(SeedState).values(name=name, hash=seed_hash)
+    await session.execute(
+        seed_insert.on_conflict_do_update(
+            index_elements=[SeedState.name],
+            set_={'hash': seed_insert.excluded.hash, 'updated': func.now()},
+        )
+    )
+    await orm_refdata_notify(session)
+    await orm_commit(session)
+
+
+async def orm_images_by_url(session: AsyncSession):
+    """
+    Асинхронно возвращает все изображения баннеров, филиалов и продуктов, заданные URL-адресом.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+
+    Возвращает:
+        list: Список уникальных URL-адресов изображений.
+    """
+    query = (
+        select(Banner.image).where(Banner.image.startswith('http'))
+        .union(select(Branches.image).where(Branches.image.startswith('http')))
+        .union(select(Product.image).where(Product.image.startswith('http')))
+    )
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def orm_image_file_id_save(session: AsyncSession, url: str, file_id: str):
+    """
+    Асинхронно заменяет URL-адрес изображения на file_id Telegram во всех таблицах, где он используется.
+
+    Аргументы:
+        session (AsyncSession): Объект AsyncSession для обмена данными с базой данных.
+        url (str): URL-адрес изображения.
+        file_id (str): file_id, который Telegram вернул после отправки изображения.
+
+    Возвращает:
+        None
+    """
+    await session.execute(update(Banner).where(Banner.image == url).values(image=file_id))
+    await session.execute(update(Branches).where(Branches.image == url).values(image=file_id))
+    result = await session.execute(update(Product).where(Product.image == url).values(image=file_id).returning(Product.id))
+    tags = [f'product:{product_id}' for product_id in result.scalars().all()]
+    if tags:
+        orm_on_commit(session, lambda: product_cache.invalidate(*tags))
+    await orm_refdata_notify(session)
+    await orm_commit(session)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+import asyncpg
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.orm_query import REFDATA_CHANNEL, orm_banner_get_all, orm_categories_get, orm_branches_get_all
+
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+# период перезагрузки, когда подписаться на REFDATA_CHANNEL нельзя
+RELOAD_INTERVAL = float(os.getenv('REFDATA_RELOAD_INTERVAL', 60))
+
+
+class BannerRow(NamedTuple):
+    name: str
+    image: str | None
+    description: str | None
+
+
+class CategoryRow(NamedTuple):
+    id: int
+    name: str
+
+
+class BranchRow(NamedTuple):
+    id: int
+    name: str
+    address: str
+    phone: str | None
+    branch_id: str
+    description: str | None
+    image: str | None
+
+
+class Snapshot(NamedTuple):
+    banners: Mapping[str, BannerRow]
+    categories: tuple[CategoryRow, ...]
+    branches: tuple[BranchRow, ...]
+    branches_by_name: Mapping[str, BranchRow]
+
+
+class ReferenceData:
+    """
+    Неизменяемый снимок таблиц Banner, Category и Branches в памяти процесса.
+
+    Снимок целиком заменяется при перезагрузке, поэтому читатели никогда не видят
+    его в промежуточном состоянии. Перезагрузку запускает NOTIFY в канал REFDATA_CHANNEL,
+    который отправляют orm-функции, меняющие эти таблицы. Без соединения для LISTEN
+    снимок перезагружается раз в RELOAD_INTERVAL секунд.
+    """
+    def __init__(self):
+        self.snapshot: Snapshot | None = None
+        self.session_pool: async_sessionmaker | None = None
+        self.listener: asyncio.Task | None = None
+        self.reloading: asyncio.Task | None = None
+        self.pending = False
+
+    async def load(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        await self.reload()
+
+    async def reload(self):
+        async with self.session_pool() as session:
+            banners = await orm_banner_get_all(session)
+            categories = await orm_categories_get(session)
+            branches = await orm_branches_get_all(session)
+        branch_rows = tuple(
+            BranchRow(b.id, b.name, b.address, b.phone, b.branch_id, b.description, b.image)
+            for b in sorted(branches, key=lambda b: b.id)
+        )
+        self.snapshot = Snapshot(
+            banners=MappingProxyType({b.name: BannerRow(b.name, b.image, b.description) for b in banners}),
+            categories=tuple(CategoryRow(c.id, c.name) for c in sorted(categories, key=lambda c: c.id)),
+            branches=branch_rows,
+            branches_by_name=MappingProxyType({b.name: b for b in branch_rows}),
+        )
+        logger.info(
+            'Справочники загружены: баннеров %s, категорий %s, филиалов %s',
+            len(banners), len(categories), len(branches),
+        )
+
+    def banner(self, name: str) -> BannerRow | None:
+        return self._current().banners.get(name)
+
+    def categories(self) -> tuple[CategoryRow, ...]:
+        return self._current().categories
+
+    def branches(self) -> tuple[BranchRow, ...]:
+        return self._current().branches
+
+    def branch(self, name: str) -> BranchRow | None:
+        return self._current().branches_by_name.get(name)
+
+    def _current(self) -> Snapshot:
+        if self.snapshot is None:
+            raise RuntimeError('Справочники не загружены, вызовите refdata.load() при старте')
+        return self.snapshot
+
+    def listen(self, dsn: str | None):
+        if dsn is None:
+            logger.warning(
+                'Через PgBouncer LISTEN %s не работает, задайте DB_LISTEN_URL; '
+                'справочники будут перезагружаться раз в %s сек.', REFDATA_CHANNEL, RELOAD_INTERVAL,
+            )
+            self.listener = asyncio.create_task(self._reload_periodically())
+        else:
+            self.listener = asyncio.create_task(self._listen(dsn))
+
+    async def stop(self):
+        # перезагрузка в процессе не должна пережить остановку и обратиться к закрытому engine
+        tasks = [task for task in (self.listener, self.reloading) if task is not None]
+        self.listener = self.reloading = None
+        self.pending = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _listen(self, dsn: str):
+        reconnecting = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(REFDATA_CHANNEL, self._on_notify)
+                if reconnecting:
+                    # уведомления, пришедшие пока соединения не было, потеряны
+                    await self.reload()
+                await closed.wait()
+                logger.warning('Соединение LISTEN %s потеряно', REFDATA_CHANNEL)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning('Не удалось подписаться на %s: %s', REFDATA_CHANNEL, e)
+            except Exception:
+                # reload() идет через SQLAlchemy (DBAPIError, InterfaceError и тд.), повторим после переподключения
+                logger.exception('Не удалось перезагрузить справочники после переподключения к %s', REFDATA_CHANNEL)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            reconnecting = True
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _reload_periodically(self):
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception('Не удалось перезагрузить справочники')
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.pending = True
+        if self.reloading is None or self.reloading.done():
+            self.reloading = asyncio.create_task(self._reload_pending())
+
+    async def _reload_pending(self):
+        while self.pending:
+            self.pending = False
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception('Не удалось перезагрузить справочники')
+
+refdata = ReferenceData()
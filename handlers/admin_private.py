@@ -2,23 +2,24 @@ from aiogram import F, types, Router
 from aiogram.filters import Command, StateFilter, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InputMediaPhoto
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.orm_query import (
     orm_banner_change_image,
     orm_categories_get,
-    orm_product_get_by_category,
+    orm_product_paginate_by_category,
     orm_product_delete,
     orm_banner_get_all,
     orm_product_get,
     orm_product_update,
     orm_product_add,
-    orm_ids_get,
 )
 
 from keyboards.inline import get_callback_buttons
 from filters.customfilters import ChatTypeFilter, BossFilter
 from utils.keyboardmaker import get_keyboard
+from utils.mailer import Broadcaster
 
 
 admin_private_router = Router()
@@ -46,17 +47,61 @@ async def admin_assortment(message: types.Message, session: AsyncSession):
     await message.answer('Выберите категорию:', reply_markup=get_callback_buttons(buttons=buttons))
 
 
+# сколько товаров в одном альбоме, sendMediaGroup принимает не больше 10
+ADMIN_PAGE_SIZE = 10
+
+
+def product_caption(product, number: int | None = None):
+    prefix = f'{number}. ' if number is not None else ''
+    return f'{prefix}<strong>{product.name}</strong>\n\n{product.description}\nСтоимость: {round(product.price, 2)}₽'
+
+
+async def send_products_page(message: types.Message, session: AsyncSession, category_id: int, page: int):
+    paginator = await orm_product_paginate_by_category(session, category_id=category_id, page=page, per_page=ADMIN_PAGE_SIZE)
+    products = paginator.get_page()
+    if not products:
+        await message.answer('В этой категории нет товаров')
+        return
+
+    first = (paginator.page - 1) * paginator.per_page + 1
+    numbered = list(enumerate(products, start=first))
+    if len(products) == 1:
+        await message.answer_photo(products[0].image, caption=product_caption(products[0], first))
+    else:
+        await message.answer_media_group([
+            InputMediaPhoto(media=product.image, caption=product_caption(product, number))
+            for number, product in numbered
+        ])
+
+    buttons = {}
+    for number, product in numbered:
+        buttons[f'Удалить {number}'] = f'delete_{product.id}'
+        buttons[f'Изменить {number}'] = f'change_{product.id}'
+    paging = {}
+    if paginator.has_previous():
+        paging['◀️ Пред.'] = f'adminpage_{category_id}_{paginator.page - 1}'
+    if paginator.has_next():
+        paging['След. ▶️'] = f'adminpage_{category_id}_{paginator.page + 1}'
+    buttons.update(paging)
+    sizes = (2,) * len(numbered) + ((len(paging),) if paging else ())
+    await message.answer(
+        f'Товары {first}–{first + len(products) - 1} из {paginator.len}, страница {paginator.page} из {paginator.pages}',
+        reply_markup=get_callback_buttons(buttons=buttons, sizes=sizes),
+    )
+
+
 @admin_private_router.callback_query(F.data.startswith('category_'))
 async def products_by_category(callback: types.CallbackQuery, session: AsyncSession):
-    category_id = callback.data.split('_')[-1]
-    allproducts = await orm_product_get_by_category(session, category_id=category_id)
-    for product in allproducts:
-        await callback.message.answer_photo(
-            product.image,
-            caption=f'<strong>{product.name}</strong>\n\n{product.description}\nСтоимость: {round(product.price, 2)}₽',
-        reply_markup=get_callback_buttons(buttons={'Удалить': f'delete_{product.id}','Изменить': f'change_{product.id}',}, sizes=(2,)))
+    category_id = int(callback.data.split('_')[-1])
+    await callback.answer()
+    await send_products_page(callback.message, session, category_id, page=1)
+
+
+@admin_private_router.callback_query(F.data.startswith('adminpage_'))
+async def products_page(callback: types.CallbackQuery, session: AsyncSession):
+    _, category_id, page = callback.data.split('_')
     await callback.answer()
-    await callback.message.answer("А вот и списочек товаров!")
+    await send_products_page(callback.message, session, int(category_id), page=int(page))
 
 
 @admin_private_router.callback_query(F.data.startswith('delete_'))
@@ -276,9 +321,7 @@ async def mailings(message: types.Message, state: FSMContext):
 
 
 @admin_private_router.message(SendMailings.mail_text)
-async def send_mailings(message: types.Message, state: FSMContext, session: AsyncSession):
-    custs_ids = await orm_ids_get(session)
-    for cust_id in custs_ids:
-        await message.bot.send_message(chat_id=cust_id.chat_id, text=message.text)
-    await message.answer('Рассылка успешно отправлена!')
+async def send_mailings(message: types.Message, state: FSMContext, broadcaster: Broadcaster):
+    mailing = await broadcaster.start(text=message.text, admin_chat_id=message.chat.id)
+    await message.answer(f'Рассылка #{mailing.id} запущена, получателей: {mailing.total}')
     await state.clear()
\ No newline at end of file
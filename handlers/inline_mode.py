@@ -0,0 +1,67 @@
+import os
+
+from aiogram import types, Router
+from aiogram.types import InlineQueryResultCachedPhoto, InlineQueryResultPhoto
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.cache import QueryCache, product_cache
+from database.orm_query import orm_product_search_top
+from handlers.menu_processing import normalize_search
+
+
+inline_mode_router = Router()
+
+# Telegram показывает не больше 50 результатов за раз, остальные запрашивает по next_offset
+INLINE_PAGE_SIZE = 20
+INLINE_MAX_RESULTS = int(os.getenv('INLINE_MAX_RESULTS', 200))
+# сколько секунд Telegram сам отдает закэшированный ответ на такой же запрос
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+
+# готовые результаты: (запрос, версия каталога) -> list[InlineQueryResult]
+inline_results = QueryCache(
+    maxsize=int(os.getenv('INLINE_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('PRODUCT_CACHE_TTL', 300)),
+)
+
+
+def product_result(product):
+    caption = f'<strong>{product.name}</strong>\n{product.description}\nСтоимость: {round(product.price, 2)}'
+    description = f'{round(product.price, 2)} - {product.description}'[:100]
+    # пока TelegramFileIds не заменил URL на file_id, фото отдается по ссылке
+    if product.image.startswith(('http://', 'https://')):
+        return InlineQueryResultPhoto(
+            id=f'product_{product.id}',
+            photo_url=product.image,
+            thumbnail_url=product.image,
+            title=product.name,
+            description=description,
+            caption=caption,
+        )
+    return InlineQueryResultCachedPhoto(
+        id=f'product_{product.id}',
+        photo_file_id=product.image,
+        title=product.name,
+        description=description,
+        caption=caption,
+    )
+
+
+@inline_results.cached(tags=lambda results, text, version: ())
+async def search_results(session: AsyncSession, text: str, version: int):
+    products = await orm_product_search_top(session, text, limit=INLINE_MAX_RESULTS)
+    return [product_result(product) for product in products]
+
+
+@inline_mode_router.inline_query()
+async def inline_catalog(inline_query: types.InlineQuery, session: AsyncSession):
+    # запросы приходят на каждое нажатие клавиши, повторный запрос берется из памяти без обращения к базе
+    results = await search_results(session, normalize_search(inline_query.query), product_cache.version)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    next_offset = offset + INLINE_PAGE_SIZE
+    await inline_query.answer(
+        results[offset:next_offset],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset < len(results) else '',
+    )
@@ -1,18 +1,20 @@
+import os
+
 from aiogram.types import InputMediaPhoto
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.orm_query import (
-    orm_banner_get,
-    orm_categories_get,
-    orm_product_get_all_by_category,
+    orm_product_paginate_by_category,
+    orm_product_search,
     orm_cart_add,
     orm_cart_product_reduce,
     orm_cart_product_delete,
-    orm_cart_by_user,
-    orm_branches_get_all,
-    orm_branch_get_by_name,
+    orm_cart_summary,
+    orm_cart_lines_stream,
     )
+from database.refdata import refdata
+from database.cache import QueryCache, product_cache
 
 from keyboards.inline import (
     get_user_main_buttons,
@@ -23,26 +25,27 @@ from keyboards.inline import (
     get_user_pickup_buttons,
     get_user_pickupfrom_buttons,
 )
-from utils.paginator import Paginator
+from utils.cartstore import cart_store
+from utils.paginator import Paginator, QueryPaginator
 from utils.keyboardmaker import get_keyboard
 
 
 async def main_menu(session: AsyncSession, level: int, menu_name: str):
-    banner = await orm_banner_get(session, name=menu_name)
+    banner = refdata.banner(menu_name)
     image = InputMediaPhoto(media=banner.image, caption=banner.description)
     keyboards = get_user_main_buttons(level=level)
     return image, keyboards
 
 
 async def catalog(session: AsyncSession, level: int, menu_name: str):
-    banner = await orm_banner_get(session, name=menu_name)
+    banner = refdata.banner(menu_name)
     image = InputMediaPhoto(media=banner.image, caption=banner.description)
-    categories = await orm_categories_get(session)
+    categories = refdata.categories()
     keyboards = get_user_catalog_buttons(level=level+1, categories=categories)
     return image, keyboards
 
 
-def pages(paginator: Paginator):
+def pages(paginator: Paginator | QueryPaginator):
     buttons = dict()
     if paginator.has_previous():
         buttons[' Пред.'] = 'previous'
@@ -51,14 +54,32 @@ def pages(paginator: Paginator):
     return buttons
 
 
+# готовые карточки товаров: (category, page, версия каталога) -> (InputMediaPhoto, InlineKeyboardMarkup)
+product_cards = QueryCache(
+    maxsize=int(os.getenv('CARD_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('PRODUCT_CACHE_TTL', 300)),
+)
+
+
+SEARCH_MAX_LENGTH = 100
+
+
 async def products(session: AsyncSession, level: int, category: int, page: int):
-    products = await orm_product_get_all_by_category(session, category_id=category)
-    paginator = Paginator(products, page=page)
+    key = (level, category, page, product_cache.version)
+    found, card = product_cards.get(key)
+    if found:
+        product_cards.hits += 1
+        return card
+    product_cards.misses += 1
+    card = await render_products(session, level, category, page)
+    product_cards.set(key, card)
+    return card
+
+
+async def render_products(session: AsyncSession, level: int, category: int, page: int):
+    paginator = await orm_product_paginate_by_category(session, category_id=category, page=page)
     product = paginator.get_page()[0]
-    image = InputMediaPhoto(media=product.image, caption=f"<strong>{product.name}</strong>\n\
-                            {product.description}\n\
-                            Стоимость: {round(product.price, 2)}\n\
-                                 <strong>Товар {paginator.page} из {paginator.pages}</strong>")
+    image = InputMediaPhoto(media=product.image, caption=product_caption(product, paginator))
     pagination_buttons = pages(paginator)
     buttons = get_product_buttons(
         level=level,
@@ -70,6 +91,45 @@ async def products(session: AsyncSession, level: int, category: int, page: int):
     return image, buttons
 
 
+def product_caption(product, paginator: QueryPaginator):
+    return f"<strong>{product.name}</strong>\n\
+                            {product.description}\n\
+                            Стоимость: {round(product.price, 2)}\n\
+                                 <strong>Товар {paginator.page} из {paginator.pages}</strong>"
+
+
+def normalize_search(text: str) -> str:
+    return ' '.join(text.split()).lower()[:SEARCH_MAX_LENGTH]
+
+
+async def search(session: AsyncSession, level: int, text: str | None, page: int):
+    if not text:
+        return None, None
+    key = (level, text, page, product_cache.version)
+    found, card = product_cards.get(key)
+    if found:
+        product_cards.hits += 1
+        return card
+    product_cards.misses += 1
+    paginator = await orm_product_search(session, text, page=page)
+    if not paginator.get_page():
+        card = None, None
+    else:
+        product = paginator.get_page()[0]
+        image = InputMediaPhoto(media=product.image, caption=product_caption(product, paginator))
+        buttons = get_product_buttons(
+            level=level,
+            category=None,
+            page=page,
+            pagination_buttons=pages(paginator),
+            product_id=product.id,
+            back_level=1,
+        )
+        card = image, buttons
+    product_cards.set(key, card)
+    return card
+
+
 async def carts(
         session: AsyncSession,
         level: int,
@@ -78,20 +138,29 @@ async def carts(
         user_id: int,
         product_id: int,
 ):
+    if cart_store.enabled:
+        cart_add, cart_reduce, cart_delete, cart_summary = (
+            cart_store.add, cart_store.reduce, cart_store.delete, cart_store.summary,
+        )
+    else:
+        cart_add, cart_reduce, cart_delete, cart_summary = (
+            orm_cart_add, orm_cart_product_reduce, orm_cart_product_delete, orm_cart_summary,
+        )
+
     if menu_name == 'increment':
-        await orm_cart_add(session, user_id=user_id, product_id=product_id)
+        await cart_add(session, user_id=user_id, product_id=product_id)
     elif menu_name == 'decrement':
-        is_cart = await orm_cart_product_reduce(session, user_id=user_id, product_id=product_id)
+        is_cart = await cart_reduce(session, user_id=user_id, product_id=product_id)
         if not is_cart and page > 1:
             page -=1 
     elif menu_name == 'delete':
-        await orm_cart_product_delete(session, user_id=user_id, product_id=product_id)
+        await cart_delete(session, user_id=user_id, product_id=product_id)
         if page > 1:
             page -= 1
     
-    carts = await orm_cart_by_user(session, user_id=user_id)
-    if not carts:
-        banner = await orm_banner_get(session, name='cart')
+    summary = await cart_summary(session, user_id=user_id, page=page)
+    if not summary.items:
+        banner = refdata.banner('cart')
         image = InputMediaPhoto(media=banner.image, caption=f'<b>{banner.description}</b>')
         keyboards = get_user_cart_buttons(
             level = level,
@@ -100,21 +169,19 @@ async def carts(
             product_id = None
             )
     else:
-        paginator = Paginator(carts, page=page)
-        cart = paginator.get_page()[0]
-        cart_price = round(cart.quantity * cart.product.price, 2)
-        total_price = round(sum(cart.quantity * cart.product.price for cart in carts), 2)
-        image = InputMediaPhoto(media=cart.product.image, caption=f"<strong>{cart.product.name}</strong>\n\
-                                {cart.product.price}$ x {cart.quantity} = {cart_price}$\
+        cart = summary.line
+        paginator = QueryPaginator([cart], summary.items, page=cart.position)
+        image = InputMediaPhoto(media=cart.image, caption=f"<strong>{cart.name}</strong>\n\
+                                {cart.price}$ x {cart.quantity} = {cart.line_total}$\
                                  \nТовар {paginator.page} из {paginator.pages} в корзине.\n\
-                                 Общая стоимость товаров в корзине {total_price}")
+                                 Общая стоимость товаров в корзине {summary.total}")
 
         pagination_buttons = pages(paginator)
         keyboards = get_user_cart_buttons(
             level = level,
-            page = page,
+            page = paginator.page,
             pagingation_buttons = pagination_buttons,
-            product_id = cart.product.id
+            product_id = cart.product_id
         )
 
     return image, keyboards
@@ -130,20 +197,21 @@ registration_kb = get_keyboard(
     
 
 async def register(session: AsyncSession, level: int, menu_name: str):
-    banner = await orm_banner_get(session, name=menu_name)
+    banner = refdata.banner(menu_name)
     image = InputMediaPhoto(media=banner.image, caption=banner.description)
     return image, registration_kb
 
 
 async def makeorder(session: AsyncSession, level: int, menu_name: str, user_id: int):
-    banner = await orm_banner_get(session, name=menu_name)
+    banner = refdata.banner(menu_name)
     if menu_name == 'order':
-        order = await orm_cart_by_user(session, user_id=user_id)
+        if cart_store.enabled:
+            await cart_store.flush(user_id)
         caption = ''
         overall = 0
-        for position in order:
-           overall += round(position.product.price * position.quantity, 2)
-           caption += f'{position.product.name} {position.quantity}шт. {round(position.product.price*position.quantity, 2)}руб\n'
+        async for position in orm_cart_lines_stream(session, user_id=user_id):
+            overall = position.total
+            caption += f'{position.name} {position.quantity}шт. {position.line_total}руб\n'
         caption += f'<strong>Общая стоимость: {overall}руб</strong>'
         image = InputMediaPhoto(media=banner.image, caption=caption)
         keyboard = get_user_order_buttons(
@@ -156,13 +224,13 @@ async def makeorder(session: AsyncSession, level: int, menu_name: str, user_id:
         keyboard = get_user_pickup_buttons(
             level = level,
             menu_name = menu_name,
-            branches= await orm_branches_get_all(session)
+            branches=refdata.branches()
         )
 
 
     elif menu_name.startswith('pickfrom_'):
         branch_name = menu_name.split('_')[-1]
-        branch = await orm_branch_get_by_name(session, name=branch_name)
+        branch = refdata.branch(branch_name)
         keyboard = get_user_pickupfrom_buttons(level=level, menu_name=menu_name, branch_name=branch.name)
         image = InputMediaPhoto(
             media=branch.image, 
@@ -180,6 +248,7 @@ async def get_menu_content(
         page: int | None = None,
         product_id: int | None = None,
         user_id: int | None = None,
+        search_text: str | None = None,
 ):
     if  level == 0:
         return await main_menu(session, level, menu_name)
@@ -192,4 +261,6 @@ async def get_menu_content(
     elif level == 4:
         return await register(session, level, menu_name)
     elif level == 5:
-        return await makeorder(session, level, menu_name, user_id)
\ No newline at end of file
+        return await makeorder(session, level, menu_name, user_id)
+    elif level == 6:
+        return await search(session, level, search_text, page)
\ No newline at end of file
@@ -1,7 +1,7 @@
 import re
 
 from aiogram import F, types, Router
-from aiogram.filters import CommandStart, or_f, StateFilter, Command
+from aiogram.filters import CommandStart, CommandObject, or_f, StateFilter, Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
@@ -19,8 +19,10 @@ from database.orm_query import (
 )
 
 # from filters.chat_types import ChatTypeFilter
-from handlers.menu_processing import get_menu_content
+from handlers.menu_processing import get_menu_content, normalize_search
 from keyboards.inline import MenuCallBack, get_user_main_buttons
+from utils.cartstore import cart_store
+from utils.coalescer import write_coalescer
 from utils.keyboardmaker import get_keyboard
 
 
@@ -30,20 +32,29 @@ user_private_router = Router()
 @user_private_router.message(CommandStart())
 async def start_cmd(message: types.Message, session: AsyncSession):
     media, reply_markup = await get_menu_content(session, level=0, menu_name="main")
-    await orm_id_save(session, chat_id=message.chat.id)
+    if write_coalescer.enabled:
+        await write_coalescer.save_chat(message.chat.id)
+    else:
+        await orm_id_save(session, chat_id=message.chat.id)
     await message.answer_photo(media.media, caption=media.caption, reply_markup=reply_markup)
 
 
 async def add_to_cart(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession):
     user = callback.from_user
-    await orm_user_add(
-        session,
-        user_id=callback.from_user.id,
-        first_name=callback.from_user.first_name,
-        last_name=callback.from_user.last_name,
-        phone=None,
-    )
-    await orm_cart_add(session, user_id=user.id, product_id=callback_data.product_id)
+    if write_coalescer.enabled:
+        await write_coalescer.save_user(user.id, first_name=user.first_name, last_name=user.last_name)
+    else:
+        await orm_user_add(
+            session,
+            user_id=callback.from_user.id,
+            first_name=callback.from_user.first_name,
+            last_name=callback.from_user.last_name,
+            phone=None,
+        )
+    if cart_store.enabled:
+        await cart_store.add(session, user_id=user.id, product_id=callback_data.product_id)
+    else:
+        await orm_cart_add(session, user_id=user.id, product_id=callback_data.product_id)
     await callback.answer('Товар добавлен в корзину')
 
 class Regstate(StatesGroup):
@@ -65,7 +76,11 @@ async def user_menu(callback: types.CallbackQuery, state: FSMContext, callback_d
         page=callback_data.page,
         product_id=callback_data.product_id,
         user_id=callback.from_user.id,
+        search_text=(await state.get_data()).get('search') if callback_data.level == 6 else None,
     )
+    if media is None:
+        await callback.answer('Результаты поиска устарели, повторите /search', show_alert=True)
+        return
     if callback_data.menu_name == 'registration':
         await state.set_state(Regstate.numberone)
         await callback.message.answer(text=media.caption, reply_markup=reply_markup)
@@ -76,6 +91,36 @@ async def user_menu(callback: types.CallbackQuery, state: FSMContext, callback_d
     await callback.answer()
 
 
+class SearchState(StatesGroup):
+    text = State()
+
+
+async def show_search(message: types.Message, state: FSMContext, session: AsyncSession, text: str):
+    text = normalize_search(text)
+    media, reply_markup = await get_menu_content(session, level=6, menu_name='search', page=1, search_text=text)
+    await state.set_state(None)
+    if media is None:
+        await message.answer(f'По запросу «{text}» ничего не найдено, попробуйте другие слова')
+        return
+    # текст запроса не помещается в callback_data, страницы результатов берут его из данных FSM
+    await state.update_data(search=text)
+    await message.answer_photo(media.media, caption=media.caption, reply_markup=reply_markup)
+
+
+@user_private_router.message(Command('search'))
+async def search_cmd(message: types.Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    if command.args and command.args.strip():
+        await show_search(message, state, session, command.args)
+        return
+    await state.set_state(SearchState.text)
+    await message.answer('Что ищем? Напишите название или описание блюда')
+
+
+@user_private_router.message(SearchState.text, F.text)
+async def search_text(message: types.Message, state: FSMContext, session: AsyncSession):
+    await show_search(message, state, session, message.text)
+
+
 @user_private_router.message(Regstate.numberone, F.text == "Ввести номер вручную")
 async def user_number(message: types.Message, state: FSMContext):
     await state.set_state(Regstate.numbertwo)
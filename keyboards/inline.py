@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -18,6 +20,23 @@ class MenuCallBack(CallbackData, prefix="menu"):
     product_id: int | None = None
 
 
+@lru_cache(maxsize=4096)
+def menu_data(level: int, menu_name: str, category: int | None = None, page: int = 1, product_id: int | None = None) -> str:
+    """
+    Упакованный MenuCallBack. pack() валидирует модель pydantic, поэтому строки кнопок
+    запоминаются и собираются один раз на набор значений.
+    """
+    return MenuCallBack(level=level, menu_name=menu_name, category=category, page=page, product_id=product_id).pack()
+
+
+@lru_cache(maxsize=4096)
+def menu_button(text: str, level: int, menu_name: str, **kwargs) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=menu_data(level, menu_name, **kwargs))
+
+
+# клавиатуры ниже кэшируются и отдаются общими объектами, их нельзя изменять после получения
+
+@lru_cache(maxsize=64)
 def get_user_main_buttons(*,level: int, sizes: tuple[int] = (2,)):
     keyboard = InlineKeyboardBuilder()
     buttons = {
@@ -30,22 +49,27 @@ def get_user_main_buttons(*,level: int, sizes: tuple[int] = (2,)):
     }
     for text, menu_name in buttons.items():
         if menu_name == 'catalog':
-            keyboard.add(InlineKeyboardButton(text=text,callback_data=MenuCallBack(level = level + 1, menu_name = menu_name).pack()))
+            keyboard.add(menu_button(text, level + 1, menu_name))
         elif menu_name == 'cart':
-            keyboard.add(InlineKeyboardButton(text=text,callback_data=MenuCallBack(level = 3, menu_name=menu_name).pack()))
+            keyboard.add(menu_button(text, 3, menu_name))
         elif menu_name == 'registration':
-            keyboard.add(InlineKeyboardButton(text=text,callback_data=MenuCallBack(level = 4, menu_name = menu_name).pack()))
+            keyboard.add(menu_button(text, 4, menu_name))
         else:
-            keyboard.add(InlineKeyboardButton(text=text,callback_data=MenuCallBack(level = level, menu_name = menu_name).pack()))
+            keyboard.add(menu_button(text, level, menu_name))
     return keyboard.adjust(*sizes).as_markup()
 
 
 def get_user_catalog_buttons(*, level: int, categories: list, sizes: tuple[int] = (2,)):
+    return _user_catalog_buttons(level, tuple(categories), tuple(sizes))
+
+
+@lru_cache(maxsize=16)
+def _user_catalog_buttons(level: int, categories: tuple, sizes: tuple[int]):
     keyboard = InlineKeyboardBuilder()
     for cat in categories:
-        keyboard.add(InlineKeyboardButton(text=cat.name, callback_data=MenuCallBack(level = 2, menu_name = cat.name, category=cat.id).pack()))
-    keyboard.add(InlineKeyboardButton(text="Назад", callback_data=MenuCallBack(level = 0, menu_name = "main").pack()))
-    keyboard.add(InlineKeyboardButton(text="В корзину", callback_data=MenuCallBack(level = 3, menu_name = "cart").pack()))
+        keyboard.add(menu_button(cat.name, 2, cat.name, category=cat.id))
+    keyboard.add(menu_button("Назад", 0, "main"))
+    keyboard.add(menu_button("В корзину", 3, "cart"))
     return keyboard.adjust(*sizes).as_markup()
 
 
@@ -56,34 +80,26 @@ def get_product_buttons(
         page: int,
         pagination_buttons: dict[str:str],
         product_id: int,
+        back_level: int | None = None,
         sizes: tuple[int] = (2,)
 ):
-    keyboard = InlineKeyboardBuilder()
-    keyboard.add(InlineKeyboardButton(text='Корзина', callback_data=MenuCallBack(level = 3, menu_name = "cart").pack()))
-    keyboard.add(InlineKeyboardButton(text='Назад', callback_data=MenuCallBack(level = level - 1, menu_name = "catalog").pack()))
-    keyboard.add(InlineKeyboardButton(text='Купить', callback_data=MenuCallBack(level = level, menu_name = "add_to_cart", product_id=product_id).pack()))
-
-    keyboard.adjust(*sizes)
+    # разметка собирается напрямую: InlineKeyboardBuilder заметно медленнее на карточках, которые меняются на каждой странице
+    buttons = [
+        menu_button('Корзина', 3, "cart"),
+        menu_button('Назад', level - 1 if back_level is None else back_level, "catalog"),
+        InlineKeyboardButton(text='Купить', callback_data=menu_data(level, "add_to_cart", product_id=product_id)),
+    ]
+    rows = _adjust(buttons, sizes)
 
     row = []
-
-
     for text, menu_name in pagination_buttons.items():
         if menu_name == "previous":
-            row.append(InlineKeyboardButton(text=text,callback_data=MenuCallBack(
-                level = level,
-                menu_name = menu_name,
-                category = category,
-                page = page - 1,).pack()
-                ))
+            row.append(menu_button(text, level, menu_name, category=category, page=page - 1))
         elif menu_name == "next":
-            row.append(InlineKeyboardButton(text=text, callback_data=MenuCallBack(
-                level = level,
-                menu_name = menu_name,
-                category= category,
-                page = page + 1,).pack()
-                ))
-    return keyboard.row(*row).as_markup()
+            row.append(menu_button(text, level, menu_name, category=category, page=page + 1))
+    if row:
+        rows.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
 def get_user_cart_buttons(
@@ -94,104 +110,74 @@ def get_user_cart_buttons(
         product_id: int,
         sizes: tuple[int] = (3,)
         ):
-    keyboard = InlineKeyboardBuilder()
-    if page:
-        keyboard.add(InlineKeyboardButton(text='+1', callback_data=MenuCallBack(
-            level = level,
-            menu_name='increment',
-            product_id=product_id,
-            page=page,
-        ).pack()))
-        keyboard.add(InlineKeyboardButton(text='-1', callback_data=MenuCallBack(
-            level = level,
-            menu_name='decrement',
-            product_id=product_id,
-            page=page,
-        ).pack()))
-        keyboard.add(InlineKeyboardButton(text='Удалить', callback_data=MenuCallBack(
-            level = level,
-            menu_name='delete',
-            product_id=product_id,
-            page=page,
-        ).pack()))
-        keyboard.adjust(*sizes)
-    
-        row = []
-        for text, menu_name in pagingation_buttons.items():
-            if menu_name == 'previous':
-                row.append(InlineKeyboardButton(text=text, callback_data=MenuCallBack(
-                    level = level,
-                    menu_name=menu_name,
-                    page=page-1
-                ).pack()))
-            elif menu_name == 'next':
-                row.append(InlineKeyboardButton(text=text, callback_data=MenuCallBack(
-                    level = level,
-                    menu_name=menu_name,
-                    page=page+1,
-                ).pack()))
-        keyboard.row(*row)
-        secondrow = [
-                InlineKeyboardButton(text='На главную', callback_data=MenuCallBack(
-                    level = 0,
-                    menu_name='main'
-                ).pack()),
-                InlineKeyboardButton(text='Купить', callback_data=MenuCallBack(
-                    level = 5,
-                    menu_name = 'order'
-                ).pack())
-            ]
-        keyboard.row(*secondrow)
-        return keyboard.as_markup()
-    else:
-        row_for_fun = []
-        row_for_fun.append(InlineKeyboardButton(text='На главную', callback_data=MenuCallBack(
-            level = 0,
-            menu_name='main'
-        ).pack()))
-        return keyboard.row(*row_for_fun).as_markup()
-    
+    if not page:
+        return _empty_cart_buttons()
+    buttons = [
+        InlineKeyboardButton(text='+1', callback_data=menu_data(level, 'increment', product_id=product_id, page=page)),
+        InlineKeyboardButton(text='-1', callback_data=menu_data(level, 'decrement', product_id=product_id, page=page)),
+        InlineKeyboardButton(text='Удалить', callback_data=menu_data(level, 'delete', product_id=product_id, page=page)),
+    ]
+    rows = _adjust(buttons, sizes)
 
+    row = []
+    for text, menu_name in pagingation_buttons.items():
+        if menu_name == 'previous':
+            row.append(menu_button(text, level, menu_name, page=page - 1))
+        elif menu_name == 'next':
+            row.append(menu_button(text, level, menu_name, page=page + 1))
+    if row:
+        rows.append(row)
+    rows.append([menu_button('На главную', 0, 'main'), menu_button('Купить', 5, 'order')])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _adjust(buttons: list, sizes: tuple[int]) -> list[list]:
+    """
+    Раскладывает кнопки по рядам так же, как InlineKeyboardBuilder.adjust.
+    """
+    rows, index = [], 0
+    sizes = list(sizes) or [len(buttons)]
+    while index < len(buttons):
+        size = sizes.pop(0) if len(sizes) > 1 else sizes[0]
+        rows.append(buttons[index:index + size])
+        index += size
+    return rows
+
+
+@lru_cache(maxsize=1)
+def _empty_cart_buttons():
+    return InlineKeyboardBuilder().row(menu_button('На главную', 0, 'main')).as_markup()
+
+
+@lru_cache(maxsize=16)
 def get_user_order_buttons(*, level: int, menu_name: str, sizes: tuple[int] = (2,)):
-    keyboard = InlineKeyboardBuilder()
     buttons = [
-        [InlineKeyboardButton(text="Самовывоз", callback_data=MenuCallBack(
-            level = level,
-            menu_name = 'pickup',
-        ).pack())],
+        [menu_button("Самовывоз", level, 'pickup')],
         [
             InlineKeyboardButton(text="Доставка", callback_data='Delivery_address'),
-            InlineKeyboardButton(text="Назад", callback_data=MenuCallBack(
-                level = 3,
-                menu_name = 'cart',
-            ).pack()),
+            menu_button("Назад", 3, 'cart'),
         ],
     ]
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     return keyboard
 
+
 def get_user_pickup_buttons(*, level: int, menu_name: str, sizes: tuple[int] = (2,), branches: list):
+    return _user_pickup_buttons(level, tuple(branches), tuple(sizes))
+
+
+@lru_cache(maxsize=16)
+def _user_pickup_buttons(level: int, branches: tuple, sizes: tuple[int]):
     keyboard = InlineKeyboardBuilder()
     for branch in branches:
-        keyboard.add(InlineKeyboardButton(text=f'{branch.name}({branch.address})', callback_data=MenuCallBack(
-            level = level,
-            menu_name = f'pickfrom_' + branch.name,
-        ).pack()))
-    keyboard.add(InlineKeyboardButton(text="Назад", callback_data=MenuCallBack(
-        level = level,
-        menu_name = 'order',
-    ).pack()))
+        keyboard.add(menu_button(f'{branch.name}({branch.address})', level, 'pickfrom_' + branch.name))
+    keyboard.add(menu_button("Назад", level, 'order'))
     return keyboard.adjust(*sizes).as_markup()
 
 
+@lru_cache(maxsize=64)
 def get_user_pickupfrom_buttons(*, level: int, branch_name: str, menu_name: str, sizes: tuple[int] = (2,)):
     keyboard = InlineKeyboardBuilder()
-    keyboard.add(InlineKeyboardButton(text="Назад", callback_data=MenuCallBack(
-        level = level,
-        menu_name = 'pickup',
-    ).pack()))
-    keyboard.add(InlineKeyboardButton(text='Оплатить', callback_data=MenuCallBack(
-        level = 0,
-        menu_name = 'payment', 
-    ).pack()))
-    return keyboard.adjust(*sizes).as_markup()
\ No newline at end of file
+    keyboard.add(menu_button("Назад", level, 'pickup'))
+    keyboard.add(menu_button('Оплатить', 0, 'payment'))
+    return keyboard.adjust(*sizes).as_markup()
@@ -0,0 +1,203 @@
+"""
+Нагрузочный тест всего стека: бот, база данных и Bot API-заглушка.
+
+Драйвер поднимает MockBotAPI и ступенчато увеличивает число виртуальных пользователей,
+которые нажимают кнопки MenuCallBack так же, как живые. Бот запускается отдельно
+без изменений кода, с адресом заглушки в TELEGRAM_API_URL и отдельной базой данных:
+
+    python -m loadtest.driver --port 8081 --stages 100,500,1000,2000 --stage-seconds 60
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python app.py
+
+Для каждой ступени печатаются действия в секунду, задержки ответа бота и доля таймаутов.
+Точка насыщения - первая ступень, на которой пропускная способность почти перестала расти
+или p95 превысил --slo-ms.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+
+from loadtest.mockapi import Faults, MockBotAPI, serve
+
+
+logger = logging.getLogger(__name__)
+
+FIRST_USER_ID = 20_000_000
+MENU_PREFIX = 'menu:'
+# регистрация уводит пользователя на reply-клавиатуру, виртуальные пользователи ее не проходят
+SKIPPED_MENUS = (':registration:',)
+
+
+@dataclass
+class StageStats:
+    users: int
+    latencies: list[float] = field(default_factory=list)
+    timeouts: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / max(self.finished - self.started, 1e-9)
+
+    def percentile(self, percent: float) -> float:
+        values = sorted(self.latencies)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, round(percent / 100 * (len(values) - 1)))]
+
+
+class VirtualUser:
+    def __init__(self, api: MockBotAPI, user_id: int, think_time: float, timeout: float):
+        self.api = api
+        self.user_id = user_id
+        self.think_time = think_time
+        self.timeout = timeout
+        self.inbox = api.inboxes[user_id]
+        self.message_id: int | None = None
+        self.buttons: list[str] = []
+
+    async def run(self, stats_for):
+        while True:
+            stats = stats_for()
+            if not self.buttons:
+                await self._act(stats, self._start)
+            else:
+                await self._act(stats, self._click)
+            await asyncio.sleep(random.expovariate(1 / self.think_time) if self.think_time else 0)
+
+    async def _act(self, stats: StageStats, action):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(action(), self.timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            self.buttons = []
+            return
+        stats.latencies.append(time.perf_counter() - started)
+
+    async def _start(self):
+        self._drain()
+        self.api.push_message(self.user_id, '/start')
+        while True:
+            event = await self.inbox.get()
+            if event.method == 'sendPhoto':
+                self._remember(event)
+                return
+
+    async def _click(self):
+        self._drain()
+        data = random.choice(self.buttons)
+        callback_id = self.api.push_callback(self.user_id, self.message_id, data)
+        while True:
+            event = await self.inbox.get()
+            if event.method == 'editMessageMedia':
+                self._remember(event)
+            elif event.callback_query_id == callback_id:
+                return
+
+    def _remember(self, event):
+        self.message_id = event.message_id
+        markup = event.reply_markup or {}
+        self.buttons = [
+            button['callback_data']
+            for row in markup.get('inline_keyboard', [])
+            for button in row
+            if button.get('callback_data', '').startswith(MENU_PREFIX)
+            and not any(skipped in button['callback_data'] for skipped in SKIPPED_MENUS)
+        ]
+
+    def _drain(self):
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+
+
+async def wait_for_bot(api: MockBotAPI):
+    logger.warning('Ждем, пока бот начнет опрашивать getUpdates или установит вебхук...')
+    while not api.calls['getUpdates'] and api.webhook is None:
+        await asyncio.sleep(0.5)
+
+
+def print_stage(stats: StageStats):
+    print(
+        f'{stats.users:>7} {len(stats.latencies):>9} {stats.throughput:>10.1f} '
+        f'{stats.percentile(50) * 1000:>9.1f} {stats.percentile(95) * 1000:>9.1f} '
+        f'{stats.percentile(99) * 1000:>9.1f} {stats.timeouts:>9}',
+        flush=True,
+    )
+
+
+def saturation(stages: list[StageStats], slo: float, growth: float) -> StageStats | None:
+    for previous, stage in zip([None, *stages], stages):
+        if stage.percentile(95) > slo:
+            return stage
+        if previous is not None and stage.throughput < previous.throughput * (1 + growth):
+            return stage
+    return None
+
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    faults = Faults(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        retry_after_ratio=args.retry_after_ratio,
+        retry_after=args.retry_after,
+        error_ratio=args.error_ratio,
+    )
+    api = MockBotAPI(faults)
+    runner = await serve(api, args.host, args.port)
+    await wait_for_bot(api)
+
+    stages: list[StageStats] = []
+    current = StageStats(users=0)
+    users: list[asyncio.Task] = []
+    print(f'{"польз.":>7} {"действий":>9} {"дейст./с":>10} {"p50 мс":>9} {"p95 мс":>9} {"p99 мс":>9} {"таймауты":>9}')
+    try:
+        for count in args.stages:
+            current = StageStats(users=count)
+            while len(users) < count:
+                user = VirtualUser(api, FIRST_USER_ID + len(users), args.think_time, args.timeout)
+                users.append(asyncio.create_task(user.run(lambda: current)))
+            await asyncio.sleep(args.stage_seconds)
+            current.finished = time.perf_counter()
+            stages.append(current)
+            print_stage(current)
+    finally:
+        for task in users:
+            task.cancel()
+        await asyncio.gather(*users, return_exceptions=True)
+        await runner.cleanup()
+
+    print(f'\nВызовы Bot API: {dict(api.calls)}')
+    print(f'Внедренные ошибки: {dict(api.injected)}')
+    point = saturation(stages, args.slo_ms / 1000, args.min_growth)
+    if point is None:
+        print('Насыщение не достигнуто, увеличьте число пользователей')
+    else:
+        print(f'Насыщение на {point.users} пользователях: {point.throughput:.1f} действий/с, '
+              f'p95 {point.percentile(95) * 1000:.1f} мс')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Заглушка Bot API и генератор нагрузки')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--stages', default='50,100,250,500,1000,2000', type=lambda value: [int(v) for v in value.split(',')])
+    parser.add_argument('--stage-seconds', type=float, default=30)
+    parser.add_argument('--think-time', type=float, default=1.0, help='средняя пауза пользователя между нажатиями, сек')
+    parser.add_argument('--timeout', type=float, default=10.0, help='сколько пользователь ждет ответа бота, сек')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='средняя задержка Bot API')
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--retry-after-ratio', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-ratio', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help='допустимый p95 ответа')
+    parser.add_argument('--min-growth', type=float, default=0.05, help='минимальный рост пропускной способности между ступенями')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,299 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'Mock', 'username': 'mock_bot'}
+# методы, для которых работает инъекция задержек и ошибок
+INJECTED_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'editMessageMedia', 'editMessageText', 'answerCallbackQuery', 'sendMediaGroup',
+})
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    jitter: float = 0.0
+    retry_after_ratio: float = 0.0
+    retry_after: int = 1
+    error_ratio: float = 0.0
+
+
+@dataclass
+class BotEvent:
+    """
+    Запрос бота, адресованный виртуальному пользователю.
+    """
+    method: str
+    chat_id: int
+    message_id: int | None
+    callback_query_id: str | None
+    reply_markup: dict | None
+    at: float
+
+
+def _json_field(value):
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        return json.loads(value)
+    return value
+
+
+def _is_url(value) -> bool:
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+
+class MockBotAPI:
+    """
+    Заглушка api.telegram.org для нагрузочного тестирования.
+
+    Отдает апдейты через getUpdates или доставляет их на вебхук, заданный setWebhook,
+    отвечает на методы отправки и редактирования сообщений и передает их виртуальным
+    пользователям через inbox. Задержки, 429 RetryAfter и ошибки задаются в Faults.
+    """
+    def __init__(self, faults: Faults | None = None):
+        self.faults = faults or Faults()
+        self.updates: list[dict] = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.inboxes: dict[int, asyncio.Queue[BotEvent]] = defaultdict(asyncio.Queue)
+        self.callbacks: dict[str, int] = {}
+        self.webhook: dict | None = None
+        self.webhook_queue: asyncio.Queue[dict] = asyncio.Queue()
+        self.webhook_workers: list[asyncio.Task] = []
+        self.calls: Counter[str] = Counter()
+        self.injected: Counter[str] = Counter()
+        # методы Bot API, доступные по HTTP; внутренние методы заглушки по URL не вызываются
+        self.methods = {
+            'getMe': self._getMe,
+            'getUpdates': self._getUpdates,
+            'setWebhook': self._setWebhook,
+            'deleteWebhook': self._deleteWebhook,
+            'getWebhookInfo': self._getWebhookInfo,
+            'sendMessage': self._sendMessage,
+            'sendPhoto': self._sendPhoto,
+            'editMessageMedia': self._editMessageMedia,
+            'editMessageText': self._editMessageText,
+            'answerCallbackQuery': self._answerCallbackQuery,
+        }
+
+    # апдейты от виртуальных пользователей
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'language_code': 'ru'}
+
+    def push_message(self, user_id: int, text: str):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self._push({'message': message})
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> str:
+        callback_id = str(next(self.callback_ids))
+        self.callbacks[callback_id] = user_id
+        self._push({'callback_query': {
+            'id': callback_id,
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'photo': [{'file_id': 'mock-photo', 'file_unique_id': 'mock-photo', 'width': 800, 'height': 600}],
+            },
+        }})
+        return callback_id
+
+    def _push(self, payload: dict):
+        update = {'update_id': next(self.update_ids), **payload}
+        if self.webhook is not None:
+            self.webhook_queue.put_nowait(update)
+            return
+        self.updates.append(update)
+        self.new_updates.set()
+
+    # HTTP
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        app.on_cleanup.append(self._stop_webhook)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if request.query:
+            params.update(request.query)
+
+        if method in INJECTED_METHODS:
+            fault = await self._inject()
+            if fault is not None:
+                self.injected[fault['error_code']] += 1
+                return web.json_response(fault)
+
+        handler = self.methods.get(method)
+        result = await handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _inject(self) -> dict | None:
+        faults = self.faults
+        if faults.latency or faults.jitter:
+            await asyncio.sleep(max(0.0, random.gauss(faults.latency, faults.jitter)))
+        roll = random.random()
+        if roll < faults.retry_after_ratio:
+            return {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {faults.retry_after}',
+                'parameters': {'retry_after': faults.retry_after},
+            }
+        if roll < faults.retry_after_ratio + faults.error_ratio:
+            return {'ok': False, 'error_code': 500, 'description': 'Internal Server Error: injected'}
+        return None
+
+    # методы Bot API
+
+    async def _getMe(self, params: dict):
+        return BOT_USER
+
+    async def _getUpdates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def _setWebhook(self, params: dict):
+        await self._stop_webhook()
+        self.webhook = {
+            'url': params['url'],
+            'secret_token': params.get('secret_token'),
+            'max_connections': int(params.get('max_connections') or 40),
+        }
+        for update in self.updates:
+            self.webhook_queue.put_nowait(update)
+        self.updates.clear()
+        self.webhook_workers = [
+            asyncio.create_task(self._deliver()) for _ in range(self.webhook['max_connections'])
+        ]
+        return True
+
+    async def _deleteWebhook(self, params: dict):
+        await self._stop_webhook()
+        self.webhook = None
+        if params.get('drop_pending_updates') in ('true', 'True', '1'):
+            self.updates.clear()
+        return True
+
+    async def _getWebhookInfo(self, params: dict):
+        webhook = self.webhook or {}
+        return {
+            'url': webhook.get('url', ''),
+            'has_custom_certificate': False,
+            'pending_update_count': self.webhook_queue.qsize() if webhook else len(self.updates),
+        }
+
+    async def _sendMessage(self, params: dict):
+        return self._message('sendMessage', params, text=params.get('text'))
+
+    async def _sendPhoto(self, params: dict):
+        return self._message('sendPhoto', params, caption=params.get('caption'), photo=params.get('photo'))
+
+    async def _editMessageMedia(self, params: dict):
+        media = _json_field(params.get('media')) or {}
+        return self._message('editMessageMedia', params, caption=media.get('caption'), photo=media.get('media'))
+
+    async def _editMessageText(self, params: dict):
+        return self._message('editMessageText', params, text=params.get('text'))
+
+    async def _answerCallbackQuery(self, params: dict):
+        callback_id = params['callback_query_id']
+        user_id = self.callbacks.pop(callback_id, None)
+        if user_id is not None:
+            self.inboxes[user_id].put_nowait(
+                BotEvent('answerCallbackQuery', user_id, None, callback_id, None, time.perf_counter())
+            )
+        return True
+
+    def _message(self, method: str, params: dict, text=None, caption=None, photo=None) -> dict | bool:
+        if 'chat_id' not in params:
+            return True
+        chat_id = int(params['chat_id'])
+        message_id = int(params.get('message_id') or next(self.message_ids))
+        reply_markup = _json_field(params.get('reply_markup'))
+        self.inboxes[chat_id].put_nowait(
+            BotEvent(method, chat_id, message_id, None, reply_markup, time.perf_counter())
+        )
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if text is not None:
+            message['text'] = text
+        if caption is not None:
+            message['caption'] = caption
+        # file_id только для фото, отправленных по file_id, чтобы бот не записал вымышленные file_id вместо URL
+        if isinstance(photo, str) and not _is_url(photo):
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo[-16:], 'width': 800, 'height': 600}]
+        if isinstance(reply_markup, dict) and 'inline_keyboard' in reply_markup:
+            message['reply_markup'] = reply_markup
+        return message
+
+    # доставка на вебхук
+
+    async def _deliver(self):
+        headers = {}
+        if self.webhook.get('secret_token'):
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.webhook['secret_token']
+        async with ClientSession(timeout=ClientTimeout(total=60)) as session:
+            while True:
+                update = await self.webhook_queue.get()
+                try:
+                    async with session.post(self.webhook['url'], json=update, headers=headers) as response:
+                        if response.status >= 400:
+                            logger.warning('Вебхук ответил %s на апдейт %s', response.status, update['update_id'])
+                except Exception as e:
+                    logger.warning('Не удалось доставить апдейт %s на вебхук: %s', update['update_id'], e)
+
+    async def _stop_webhook(self, *args):
+        for task in self.webhook_workers:
+            task.cancel()
+        await asyncio.gather(*self.webhook_workers, return_exceptions=True)
+        self.webhook_workers = []
+
+
+async def serve(api: MockBotAPI, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Заглушка Bot API слушает http://%s:%s', host, port)
+    return runner
@@ -1,12 +1,29 @@
+import asyncio
+from contextvars import ContextVar
 from typing import Any, Awaitable, Callable, Dict
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
 from aiogram.types import TelegramObject
 
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+# сессия текущего апдейта вместе с задачей, которая ее обрабатывает
+current_session: ContextVar[tuple[asyncio.Task, AsyncSession] | None] = ContextVar('current_session', default=None)
 
 
 class DataBaseSession(BaseMiddleware):
+    """
+    Открывает сессию на апдейт в режиме unit of work: orm-функции только делают flush,
+    а commit выполняется в конце хендлера, rollback - если хендлер упал.
+
+    Вместе с ReleaseSessionBeforeRequest транзакция завершается раньше, при первом запросе
+    к Bot API. Записи, сделанные до этого запроса, фиксируются в этот момент и не откатываются,
+    если хендлер упадет позже; откатывается только то, что записано после последнего запроса.
+    """
     def __init__(self, session_pool: async_sessionmaker):
         self.session_pool = session_pool
 
@@ -17,6 +34,55 @@ class DataBaseSession(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any],
     ) -> Any:
+        # AsyncSession берет соединение из пула только при первом запросе
         async with self.session_pool() as session:
+            session.info['unit_of_work'] = True
             data['session'] = session
-            return await handler(event, data)
\ No newline at end of file
+            token = current_session.set((asyncio.current_task(), session))
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                current_session.reset(token)
+            await release_session(session)
+            return result
+
+
+async def release_session(session: AsyncSession):
+    """
+    Завершает транзакцию сессии: commit, если она жива, или rollback после ошибки flush.
+    """
+    transaction = session.get_transaction()
+    if transaction is None:
+        return
+    if transaction.is_active:
+        await session.commit()
+    else:
+        await session.rollback()
+
+
+class ReleaseSessionBeforeRequest(BaseRequestMiddleware):
+    """
+    Завершает открытую транзакцию сессии апдейта перед каждым запросом к Bot API,
+    чтобы соединение вернулось в пул на время медленного HTTP-запроса к Telegram.
+
+    Поэтому граница транзакции - не весь апдейт, а участок хендлера между запросами к Bot API:
+    записи до запроса фиксируются commit и не откатываются при последующей ошибке хендлера.
+    Хендлер, которому нужна атомарность нескольких записей, должен сделать их все до первого
+    обращения к Telegram.
+    """
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        owner = current_session.get()
+        if owner is not None:
+            task, session = owner
+            # задачи, запущенные из хендлера (например, рассылки), наследуют контекст, но не сессию
+            if task is asyncio.current_task():
+                await release_session(session)
+        return await make_request(bot, method)
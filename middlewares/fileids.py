@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError
+from aiogram.methods import EditMessageMedia, Response, SendPhoto, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputMediaPhoto, Message
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.orm_query import orm_images_by_url, orm_image_file_id_save
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_url(value) -> bool:
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+
+class TelegramFileIds(BaseRequestMiddleware):
+    """
+    Запоминает file_id, который Telegram возвращает после первой отправки изображения по URL,
+    подставляет его во все следующие отправки и сохраняет вместо URL в базе.
+    """
+    def __init__(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        self.file_ids: dict[str, str] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        url = None
+        if isinstance(method, SendPhoto) and _is_url(method.photo):
+            url = method.photo
+            if url in self.file_ids:
+                method = method.model_copy(update={'photo': self.file_ids[url]})
+        elif isinstance(method, EditMessageMedia) and isinstance(method.media, InputMediaPhoto) and _is_url(method.media.media):
+            url = method.media.media
+            if url in self.file_ids:
+                media = method.media.model_copy(update={'media': self.file_ids[url]})
+                method = method.model_copy(update={'media': media})
+
+        result = await make_request(bot, method)
+
+        if url is not None and url not in self.file_ids and isinstance(result, Message) and result.photo:
+            self.file_ids[url] = result.photo[-1].file_id
+            task = asyncio.create_task(self._save(url, self.file_ids[url]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return result
+
+    async def _save(self, url: str, file_id: str):
+        try:
+            async with self.session_pool() as session:
+                await orm_image_file_id_save(session, url, file_id)
+        except Exception:
+            logger.exception('Не удалось сохранить file_id для %s', url)
+
+    async def warm_up(self, bot: Bot, chat_id: int):
+        """
+        Отправляет все изображения, заданные URL, в служебный чат, чтобы получить их file_id заранее.
+        """
+        async with self.session_pool() as session:
+            urls = await orm_images_by_url(session)
+        for url in urls:
+            if url in self.file_ids:
+                continue
+            try:
+                message = await bot.send_photo(chat_id, url, disable_notification=True)
+                await bot.delete_message(chat_id, message.message_id)
+            except TelegramAPIError as e:
+                logger.warning('Не удалось загрузить изображение %s: %s', url, e)
+        logger.info('Прогрев изображений завершен: %s URL', len(urls))
+
+    async def close(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,81 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from aiogram.types.update import UpdateTypeLookupError
+
+from keyboards.inline import MenuCallBack
+from utils.metrics import handlers, handler_errors, telegram_errors, telegram_requests, updates
+
+
+class UpdateMetrics(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: время обработки апдейта целиком, включая остальные middleware.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            event_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        except UpdateTypeLookupError:
+            event_type = 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            updates.labels(event_type).observe(time.perf_counter() - started)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """
+    Внутренний middleware роутера: время работы хендлера с метками роутера, хендлера и уровня меню.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = data['handler'].callback
+        callback_data = data.get('callback_data')
+        labels = (
+            callback.__module__.rpartition('.')[-1],
+            callback.__name__,
+            callback_data.level if isinstance(callback_data, MenuCallBack) else '',
+        )
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.labels(*labels).inc()
+            raise
+        finally:
+            handlers.labels(*labels).observe(time.perf_counter() - started)
+
+
+class TelegramRequestMetrics(BaseRequestMiddleware):
+    """
+    Время и ошибки запросов к Bot API по методам.
+    """
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            telegram_requests.labels(name).observe(time.perf_counter() - started)
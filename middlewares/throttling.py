@@ -0,0 +1,130 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from keyboards.inline import MenuCallBack
+
+
+# (скорость пополнения в сек., емкость корзины) для каждого уровня меню, None - сообщения и прочие колбэки
+THROTTLE_LIMITS = {
+    None: (1.0, 5),
+    0: (1.0, 5),
+    1: (1.0, 5),
+    2: (2.0, 8),
+    3: (2.0, 8),
+    4: (1.0, 5),
+    5: (1.0, 5),
+    6: (2.0, 8),
+}
+THROTTLE_RATE_FACTOR = float(os.getenv('THROTTLE_RATE_FACTOR', 1))
+THROTTLE_DUPLICATE_WINDOW = float(os.getenv('THROTTLE_DUPLICATE_WINDOW', 1))
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', 10000))
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def consume(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту апдейтов от одного пользователя корзинами токенов по уровням MenuCallBack
+    и сразу отвечает на повторы одинакового колбэка, не доходя до хендлеров и базы данных.
+
+    Регистрируется раньше DataBaseSession, чтобы отброшенные апдейты не брали соединение из пула.
+    """
+    def __init__(
+            self,
+            limits: dict[int | None, tuple[float, int]] = THROTTLE_LIMITS,
+            duplicate_window: float = THROTTLE_DUPLICATE_WINDOW,
+            max_users: int = THROTTLE_MAX_USERS,
+    ):
+        self.limits = {level: (rate * THROTTLE_RATE_FACTOR, capacity) for level, (rate, capacity) in limits.items()}
+        self.duplicate_window = duplicate_window
+        self.max_users = max_users
+        # полная корзина ничем не отличается от новой, поэтому давно не использованные можно вытеснять
+        self.buckets: OrderedDict[tuple[int, int | None], TokenBucket] = OrderedDict()
+        self.recent: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self.throttled = 0
+        self.duplicates = 0
+
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None or not isinstance(event, Update):
+            return await handler(event, data)
+        # inline-запросы идут на каждое нажатие клавиши, клиент сам их придерживает, а повторы отдаются из кэша
+        if event.inline_query is not None:
+            return await handler(event, data)
+
+        callback = event.callback_query
+        if callback is not None and callback.data and self._is_duplicate(user.id, callback.data):
+            self.duplicates += 1
+            await callback.answer()
+            return None
+
+        level = self._level(callback.data) if callback is not None and callback.data else None
+        if not self._bucket(user.id, level).consume():
+            self.throttled += 1
+            if callback is not None:
+                await callback.answer('Слишком часто, подождите немного')
+            return None
+        return await handler(event, data)
+
+    def _is_duplicate(self, user_id: int, payload: str) -> bool:
+        now = time.monotonic()
+        while self.recent:
+            key, seen = next(iter(self.recent.items()))
+            if now - seen < self.duplicate_window:
+                break
+            del self.recent[key]
+        key = (user_id, payload)
+        if key in self.recent:
+            return True
+        self.recent[key] = now
+        return False
+
+    def _bucket(self, user_id: int, level: int | None) -> TokenBucket:
+        if level not in self.limits:
+            level = None
+        key = (user_id, level)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*self.limits[level])
+            while len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    @staticmethod
+    def _level(payload: str) -> int | None:
+        if not payload.startswith(f'{MenuCallBack.__prefix__}:'):
+            return None
+        try:
+            return MenuCallBack.unpack(payload).level
+        except (TypeError, ValueError):
+            return None
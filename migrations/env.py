@@ -0,0 +1,41 @@
+import asyncio
+
+from alembic import context
+from dotenv import find_dotenv, load_dotenv
+load_dotenv(find_dotenv())
+
+from database.engine import databaseurl, engine
+from database.models import Based
+
+
+config = context.config
+target_metadata = Based.metadata
+
+
+def run_migrations_offline():
+    context.configure(url=databaseurl, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+        await connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    # create_db() передает свое соединение, при запуске из консоли подключаемся сами
+    connection = config.attributes.get('connection')
+    if connection is None:
+        asyncio.run(run_async_migrations())
+    else:
+        do_run_migrations(connection)
@@ -0,0 +1,120 @@
+"""initial schema
+
+Исходная схема, которую раньше создавал Based.metadata.create_all.
+Таблицы, уже созданные через create_all, пропускаются.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def timestamps():
+    return (
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+    )
+
+
+def upgrade() -> None:
+    existing = set() if context.is_offline_mode() else set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'user' not in existing:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('user_id', sa.BigInteger(), nullable=False),
+            sa.Column('first_name', sa.String(length=150), nullable=True),
+            sa.Column('last_name', sa.String(length=150), nullable=True),
+            sa.Column('phone', sa.String(length=13), nullable=True),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id'),
+        )
+    if 'category' not in existing:
+        op.create_table(
+            'category',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('name', sa.String(length=150), nullable=False),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'product' not in existing:
+        op.create_table(
+            'product',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('description', sa.Text(), nullable=False),
+            sa.Column('price', sa.Numeric(precision=7, scale=2), nullable=False),
+            sa.Column('image', sa.String(length=150), nullable=False),
+            sa.Column('category_id', sa.Integer(), nullable=False),
+            *timestamps(),
+            sa.ForeignKeyConstraint(['category_id'], ['category.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'banner' not in existing:
+        op.create_table(
+            'banner',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('name', sa.String(length=25), nullable=False),
+            sa.Column('image', sa.String(length=150), nullable=True),
+            sa.Column('description', sa.Text(), nullable=True),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('name'),
+        )
+    if 'cart' not in existing:
+        op.create_table(
+            'cart',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('user_id', sa.BigInteger(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            *timestamps(),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'chat_ids' not in existing:
+        op.create_table(
+            'chat_ids',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('chat_id', sa.BigInteger(), nullable=False),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('chat_id'),
+        )
+    if 'mailings' not in existing:
+        op.create_table(
+            'mailings',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+        )
+    if 'branches' not in existing:
+        op.create_table(
+            'branches',
+            sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column('name', sa.String(length=150), nullable=False),
+            sa.Column('address', sa.String(length=150), nullable=False),
+            sa.Column('phone', sa.String(length=13), nullable=True),
+            sa.Column('branch_id', sa.String(length=7), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('image', sa.String(length=150), nullable=True),
+            *timestamps(),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('branch_id'),
+        )
+
+
+def downgrade() -> None:
+    for table in ('branches', 'mailings', 'chat_ids', 'cart', 'banner', 'product', 'category', 'user'):
+        op.drop_table(table)
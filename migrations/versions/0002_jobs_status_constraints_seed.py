@@ -0,0 +1,75 @@
+"""mailing jobs, chat status, cart and category constraints, seed state
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mailings', sa.Column('text', sa.Text(), nullable=False, server_default=''))
+    op.add_column('mailings', sa.Column('admin_chat_id', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('mailings', sa.Column('status', sa.String(length=16), nullable=False, server_default='done'))
+    op.add_column('mailings', sa.Column('cursor', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('mailings', sa.Column('total', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('mailings', sa.Column('sent', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('mailings', sa.Column('failed', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('mailings', sa.Column('finished', sa.DateTime(), nullable=True))
+    for column in ('text', 'admin_chat_id', 'status', 'cursor', 'total', 'sent', 'failed'):
+        op.alter_column('mailings', column, server_default=None)
+
+    op.add_column('chat_ids', sa.Column('status', sa.String(length=16), nullable=False, server_default='active'))
+    op.add_column('chat_ids', sa.Column('last_failure', sa.DateTime(), nullable=True))
+
+    # до уникального ключа двойные нажатия могли создать дубликаты позиций корзины
+    op.execute("""
+        WITH merged AS (
+            SELECT min(id) AS keep_id, user_id, product_id, sum(quantity) AS quantity
+            FROM cart GROUP BY user_id, product_id HAVING count(*) > 1
+        ), updated AS (
+            UPDATE cart SET quantity = merged.quantity
+            FROM merged WHERE cart.id = merged.keep_id
+        )
+        DELETE FROM cart USING merged
+        WHERE cart.user_id = merged.user_id AND cart.product_id = merged.product_id AND cart.id <> merged.keep_id
+    """)
+    op.create_unique_constraint('uq_cart_user_product', 'cart', ['user_id', 'product_id'])
+
+    op.execute("""
+        UPDATE product SET category_id = keep.id
+        FROM category AS dup
+        JOIN (SELECT min(id) AS id, name FROM category GROUP BY name) AS keep ON keep.name = dup.name
+        WHERE product.category_id = dup.id AND dup.id <> keep.id
+    """)
+    op.execute("""
+        DELETE FROM category USING category AS keep
+        WHERE category.name = keep.name AND category.id > keep.id
+    """)
+    op.create_unique_constraint('category_name_key', 'category', ['name'])
+
+    op.create_table(
+        'seed_state',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('seed_state')
+    op.drop_constraint('category_name_key', 'category', type_='unique')
+    op.drop_constraint('uq_cart_user_product', 'cart', type_='unique')
+    op.drop_column('chat_ids', 'last_failure')
+    op.drop_column('chat_ids', 'status')
+    for column in ('finished', 'failed', 'sent', 'total', 'cursor', 'status', 'admin_chat_id', 'text'):
+        op.drop_column('mailings', column)
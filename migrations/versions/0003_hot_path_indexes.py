@@ -0,0 +1,35 @@
+"""indexes for catalog, cart, branch and mailing queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # страницы каталога: WHERE category_id = ? ORDER BY id LIMIT/OFFSET и COUNT по категории
+    op.create_index('ix_product_category_id_id', 'product', ['category_id', 'id'])
+    # поиск по user_id и по (user_id, product_id) уже покрывает uq_cart_user_product,
+    # а product_id нужен каскадному удалению позиций при удалении товара
+    op.create_index('ix_cart_product_id', 'cart', ['product_id'])
+    op.create_index('ix_branches_name', 'branches', ['name'])
+    # курсор рассылки: WHERE status = ? AND id > ? ORDER BY id. Частичный индекс не подходит:
+    # status приходит параметром, и в generic-плане asyncpg условие индекса не доказать
+    op.create_index('ix_chat_ids_status_id', 'chat_ids', ['status', 'id'])
+    # очистка недоступных чатов по last_failure, у активных чатов он NULL
+    op.create_index('ix_chat_ids_last_failure', 'chat_ids', ['last_failure'])
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_ids_last_failure', table_name='chat_ids')
+    op.drop_index('ix_chat_ids_status_id', table_name='chat_ids')
+    op.drop_index('ix_branches_name', table_name='branches')
+    op.drop_index('ix_cart_product_id', table_name='cart')
+    op.drop_index('ix_product_category_id_id', table_name='product')
@@ -0,0 +1,42 @@
+"""product full-text search: generated tsvector, GIN and trigram indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # название весит больше описания, конфигурация russian дает стемминг
+    op.add_column('product', sa.Column(
+        'search',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index('ix_product_search', 'product', ['search'], postgresql_using='gin')
+    # нечеткий поиск по названию с опечатками: name % запрос
+    op.create_index(
+        'ix_product_name_trgm', 'product', ['name'],
+        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_name_trgm', table_name='product')
+    op.drop_index('ix_product_search', table_name='product')
+    op.drop_column('product', 'search')
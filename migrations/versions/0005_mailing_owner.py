@@ -0,0 +1,24 @@
+"""mailing owner and heartbeat for claiming jobs across replicas
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mailings', sa.Column('owner', sa.String(length=64), nullable=True))
+    op.add_column('mailings', sa.Column('heartbeat', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('mailings', 'heartbeat')
+    op.drop_column('mailings', 'owner')
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from decimal import Decimal
+from typing import NamedTuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.orm_query import CartSummary, orm_cart_quantities, orm_carts_save, orm_products_get_many
+
+
+logger = logging.getLogger(__name__)
+
+
+class CartLine(NamedTuple):
+    product_id: int
+    quantity: int
+    name: str
+    price: Decimal
+    image: str
+    line_total: Decimal
+    position: int
+
+
+class CartStore:
+    """
+    Корзины пользователей в памяти с отложенной записью в таблицу Cart.
+
+    Изменения применяются к корзине в памяти сразу, а в базу попадают пачкой
+    (orm_carts_save) раз в interval секунд, перед оформлением заказа и при остановке бота.
+    Корзина загружается из базы при первом обращении; корзины с незаписанными
+    изменениями не вытесняются.
+
+    Только для одной реплики бота: корзины других процессов здесь не видны, и если апдейты
+    пользователя попадают на две реплики, корзины расходятся, а последняя запись в базу
+    затирает количества, записанные другой.
+    """
+    def __init__(self, enabled: bool, interval: float, maxsize: int):
+        self.enabled = enabled
+        self.interval = interval
+        self.maxsize = maxsize
+        self.carts: OrderedDict[int, dict[int, int]] = OrderedDict()
+        self.dirty: set[int] = set()
+        self.loading: dict[int, asyncio.Lock] = {}
+        self.lock = asyncio.Lock()
+        self.session_pool: async_sessionmaker | None = None
+        self.flusher: asyncio.Task | None = None
+        self.mutations = 0
+        self.flushes = 0
+
+    def start(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        if self.enabled:
+            self.flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        if self.enabled:
+            await self.flush()
+            logger.info('Корзины: изменений %s, записей в базу %s', self.mutations, self.flushes)
+
+    async def add(self, session: AsyncSession, user_id: int, product_id: int) -> int:
+        cart = await self._cart(session, user_id)
+        cart[product_id] = cart.get(product_id, 0) + 1
+        self._touch(user_id)
+        return cart[product_id]
+
+    async def reduce(self, session: AsyncSession, user_id: int, product_id: int) -> bool:
+        cart = await self._cart(session, user_id)
+        quantity = cart.get(product_id)
+        if quantity is None:
+            return False
+        if quantity > 1:
+            cart[product_id] = quantity - 1
+        else:
+            del cart[product_id]
+        self._touch(user_id)
+        return quantity > 1
+
+    async def delete(self, session: AsyncSession, user_id: int, product_id: int):
+        cart = await self._cart(session, user_id)
+        if cart.pop(product_id, None) is not None:
+            self._touch(user_id)
+
+    async def summary(self, session: AsyncSession, user_id: int, page: int) -> CartSummary:
+        """
+        Возвращает сводку корзины в том же виде, что и orm_cart_summary. Данные продуктов берутся
+        из product_cache, недостающие загружаются одним запросом, позиции удаленных продуктов
+        выбрасываются из корзины.
+        """
+        cart = await self._cart(session, user_id)
+        products = await orm_products_get_many(session, list(cart))
+        lines = []
+        for product_id, quantity in list(cart.items()):
+            product = products.get(product_id)
+            if product is None:
+                del cart[product_id]
+                self._touch(user_id)
+                continue
+            lines.append((product, quantity))
+        if not lines:
+            return CartSummary(items=0, total=Decimal('0.00'), line=None)
+        position = min(page, len(lines))
+        product, quantity = lines[position - 1]
+        line = CartLine(
+            product.id, quantity, product.name, product.price, product.image, product.price * quantity, position,
+        )
+        total = sum((product.price * quantity for product, quantity in lines), Decimal('0.00'))
+        return CartSummary(items=len(lines), total=total, line=line)
+
+    async def flush(self, user_id: int | None = None):
+        async with self.lock:
+            users = [user_id] if user_id is not None else list(self.dirty)
+            users = [user for user in users if user in self.dirty]
+            if not users:
+                return
+            self.dirty.difference_update(users)
+            carts = {user: dict(self.carts[user]) for user in users}
+            try:
+                async with self.session_pool() as session:
+                    await orm_carts_save(session, carts)
+            except Exception:
+                self.dirty.update(users)
+                raise
+            self.flushes += 1
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Не удалось записать корзины в базу, повторим через %s сек.', self.interval)
+
+    async def _cart(self, session: AsyncSession, user_id: int) -> dict[int, int]:
+        cart = self.carts.get(user_id)
+        if cart is not None:
+            self.carts.move_to_end(user_id)
+            return cart
+        lock = self.loading.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            cart = self.carts.get(user_id)
+            if cart is None:
+                cart = self.carts[user_id] = await orm_cart_quantities(session, user_id)
+                self._evict()
+        if not lock.locked():
+            self.loading.pop(user_id, None)
+        return cart
+
+    def _touch(self, user_id: int):
+        self.mutations += 1
+        self.dirty.add(user_id)
+
+    def _evict(self):
+        extra = len(self.carts) - self.maxsize
+        for user_id in list(self.carts):
+            if extra <= 0:
+                break
+            if user_id not in self.dirty:
+                del self.carts[user_id]
+                extra -= 1
+
+
+# CART_WRITE_BACK включается только при одной реплике бота, см. CartStore
+cart_store = CartStore(
+    enabled=os.getenv('CART_WRITE_BACK', '').lower() in ('1', 'true', 'yes', 'on'),
+    interval=float(os.getenv('CART_FLUSH_INTERVAL', 5)),
+    maxsize=int(os.getenv('CART_STORE_SIZE', 10000)),
+)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.cache import known_users
+from database.orm_query import orm_ids_save_many, orm_users_add_many
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """
+    Объединяет записи новых чатов и пользователей из одновременных апдейтов в пачки.
+
+    Вызов save_chat или save_user ставит строку в очередь и ждет, пока пачка не будет
+    зафиксирована в базе. Пачка записывается одним многострочным INSERT ... ON CONFLICT
+    в отдельной транзакции через delay секунд после первой строки или сразу,
+    как только набралось batch_size строк. Пока пишется одна пачка, копится следующая.
+    Уже известные пользователи (known_users) в очередь не попадают. Чаты пишутся всегда,
+    чтобы вернувшийся чат снова стал активным.
+    """
+    def __init__(self, enabled: bool, delay: float, batch_size: int):
+        self.enabled = enabled
+        self.delay = delay
+        self.batch_size = batch_size
+        self.chats: dict[int, asyncio.Future] = {}
+        self.users: dict[int, tuple[dict, asyncio.Future]] = {}
+        self.pending = asyncio.Event()
+        self.full = asyncio.Event()
+        self.session_pool: async_sessionmaker | None = None
+        self.writer: asyncio.Task | None = None
+        self.stopping = False
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def start(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        if self.enabled:
+            self.writer = asyncio.create_task(self._write_periodically())
+
+    async def stop(self):
+        # запись не прерывается отменой, иначе апдейты, ждущие взятую пачку, зависнут
+        self.stopping = True
+        if self.writer:
+            self.pending.set()
+            self.full.set()
+            await self.writer
+            self.writer = None
+        if self.enabled:
+            await self.flush()
+            logger.info('Объединение записей: пачек %s, строк %s', self.batches, self.rows)
+
+    async def save_chat(self, chat_id: int):
+        if self.stopping:
+            return await self._write_now(orm_ids_save_many, [chat_id])
+        future = self.chats.get(chat_id)
+        if future is None:
+            future = self.chats[chat_id] = asyncio.get_running_loop().create_future()
+            self._wake()
+        await asyncio.shield(future)
+
+    async def save_user(self, user_id: int, first_name: str | None = None, last_name: str | None = None,
+                        phone: str | None = None):
+        if user_id in known_users:
+            return
+        data = {'user_id': user_id, 'first_name': first_name, 'last_name': last_name, 'phone': phone}
+        if self.stopping:
+            return await self._write_now(orm_users_add_many, [data])
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = (data, asyncio.get_running_loop().create_future())
+            self._wake()
+        await asyncio.shield(entry[1])
+
+    async def flush(self):
+        chats, self.chats = self.chats, {}
+        users, self.users = self.users, {}
+        items = list(users.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            await self._write(orm_users_add_many, [data for _, (data, _) in batch], [future for _, (_, future) in batch])
+        items = list(chats.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            await self._write(orm_ids_save_many, [chat_id for chat_id, _ in batch], [future for _, future in batch])
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self.chats) + len(self.users),
+            'batches': self.batches,
+            'rows': self.rows,
+            'errors': self.errors,
+            'rows_per_batch': self.rows / self.batches if self.batches else 0.0,
+        }
+
+    def _wake(self):
+        self.pending.set()
+        if len(self.chats) + len(self.users) >= self.batch_size:
+            self.full.set()
+
+    async def _write_periodically(self):
+        while not self.stopping:
+            await self.pending.wait()
+            if not self.full.is_set():
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.delay)
+                except asyncio.TimeoutError:
+                    pass
+            self.pending.clear()
+            self.full.clear()
+            await self.flush()
+
+    async def _write_now(self, orm_save: Callable[[AsyncSession, list], Awaitable[None]], rows: list):
+        # после остановки писателя очередь никто не разберет, поэтому апдейты, которые
+        # еще дорабатывают во время выключения, пишут свою строку сразу
+        future = asyncio.get_running_loop().create_future()
+        await self._write(orm_save, rows, [future])
+        await future
+
+    async def _write(self, orm_save: Callable[[AsyncSession, list], Awaitable[None]], rows: list,
+                     futures: list[asyncio.Future]):
+        try:
+            async with self.session_pool() as session:
+                await orm_save(session, rows)
+        except Exception as e:
+            self.errors += 1
+            logger.exception('Не удалось записать пачку из %s строк', len(rows))
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    # ожидающий апдейт мог быть отменен, исключение не должно остаться непрочитанным
+                    future.exception()
+            return
+        self.batches += 1
+        self.rows += len(rows)
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+
+write_coalescer = WriteCoalescer(
+    enabled=os.getenv('WRITE_COALESCING', '').lower() in ('1', 'true', 'yes', 'on'),
+    delay=float(os.getenv('WRITE_COALESCE_DELAY', 0.005)),
+    batch_size=int(os.getenv('WRITE_COALESCE_BATCH', 500)),
+)
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.orm_query import (
+    orm_mailings_add,
+    orm_mailing_get,
+    orm_mailing_claim,
+    orm_mailings_get_unfinished,
+    orm_mailing_progress_save,
+    orm_ids_get_batch,
+    orm_chats_mark_dead,
+    orm_chats_prune_dead,
+)
+
+
+logger = logging.getLogger(__name__)
+
+MAILING_RATE = float(os.getenv('MAILING_RATE', 25))
+MAILING_CONCURRENCY = int(os.getenv('MAILING_CONCURRENCY', 10))
+MAILING_BATCH = int(os.getenv('MAILING_BATCH', 200))
+MAILING_REPORT_INTERVAL = float(os.getenv('MAILING_REPORT_INTERVAL', 5))
+MAILING_PRUNE_AFTER = timedelta(days=int(os.getenv('MAILING_PRUNE_AFTER_DAYS', 30)))
+MAILING_RETRIES = 3
+# сколько раз повторять операцию с базой внутри рассылки, прежде чем пометить ее failed
+MAILING_DB_RETRIES = int(os.getenv('MAILING_DB_RETRIES', 5))
+# владелец, который не отмечался дольше этого срока, считается пропавшим, его рассылку забирает другой процесс
+MAILING_STALE_AFTER = timedelta(seconds=int(os.getenv('MAILING_STALE_AFTER', 120)))
+
+
+def classify_send_error(error: TelegramAPIError) -> str | None:
+    """
+    Возвращает статус мертвого чата по ошибке отправки или None, если ошибка временная.
+    """
+    message = error.message.lower()
+    if isinstance(error, TelegramForbiddenError):
+        if 'deactivated' in message:
+            return 'deactivated'
+        return 'blocked'
+    if isinstance(error, TelegramBadRequest) and 'chat not found' in message:
+        return 'not_found'
+    return None
+
+
+class RateLimiter:
+    """
+    Глобальный лимитер: выдает не более rate разрешений в секунду всем отправителям сразу.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+class Broadcaster:
+    """
+    Фоновые рассылки с ограничением скорости и возобновлением после перезапуска.
+
+    Состояние задания (курсор по Chat_ids.id и счетчики) сохраняется после каждой
+    порции получателей, поэтому после падения повторно может уйти не больше одной порции.
+    Задание ведет только процесс, который закрепил его за собой (Mailings.owner)
+    и регулярно отмечается; рассылки пропавших процессов забирают остальные реплики.
+    """
+    def __init__(
+            self,
+            bot: Bot,
+            session_pool: async_sessionmaker,
+            rate: float = MAILING_RATE,
+            concurrency: int = MAILING_CONCURRENCY,
+            batch_size: int = MAILING_BATCH,
+    ):
+        self.bot = bot
+        self.session_pool = session_pool
+        self.limiter = RateLimiter(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.owner = f'{socket.gethostname()[:40]}:{os.getpid()}:{uuid4().hex[:8]}'
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.watcher: asyncio.Task | None = None
+
+    async def start(self, text: str, admin_chat_id: int):
+        async with self.session_pool() as session:
+            mailing = await orm_mailings_add(session, {'text': text, 'admin_chat_id': admin_chat_id, 'owner': self.owner})
+        self._spawn(mailing.id)
+        return mailing
+
+    async def resume(self):
+        await self._claim_unfinished()
+        self.watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        tasks = list(self.tasks.values())
+        if self.watcher:
+            tasks.append(self.watcher)
+            self.watcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    async def _claim_unfinished(self):
+        async with self.session_pool() as session:
+            mailings = await orm_mailings_get_unfinished(session)
+            for mailing in mailings:
+                if mailing.id in self.tasks:
+                    continue
+                if await orm_mailing_claim(session, mailing.id, self.owner, MAILING_STALE_AFTER):
+                    logger.info('Возобновляем рассылку #%s с курсора %s', mailing.id, mailing.cursor)
+                    self._spawn(mailing.id)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(MAILING_STALE_AFTER.total_seconds() / 2)
+            try:
+                await self._claim_unfinished()
+            except Exception:
+                logger.exception('Не удалось проверить незавершенные рассылки')
+
+    def _spawn(self, mailing_id: int):
+        task = asyncio.create_task(self._run(mailing_id))
+        self.tasks[mailing_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(mailing_id, None))
+
+    async def _retry(self, mailing_id: int, description: str, action):
+        for attempt in range(1, MAILING_DB_RETRIES + 1):
+            try:
+                return await action()
+            except Exception as e:
+                if attempt == MAILING_DB_RETRIES:
+                    raise
+                delay = min(2 ** attempt, 60)
+                logger.warning('Рассылка #%s: %s не удалось (%s), повтор через %s сек.', mailing_id, description, e, delay)
+                await asyncio.sleep(delay)
+
+    async def _run(self, mailing_id: int):
+        async def load():
+            async with self.session_pool() as session:
+                return await orm_mailing_get(session, mailing_id)
+
+        mailing, report = None, None
+        cursor = sent = failed = sent_at_start = 0
+        started = reported = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(chat_id: int):
+            async with semaphore:
+                return await self._send(chat_id, mailing.text)
+
+        async def save(status: str | None = None, dead: dict[str, list[int]] | None = None):
+            async with self.session_pool() as session:
+                for dead_status, chat_ids in (dead or {}).items():
+                    await orm_chats_mark_dead(session, chat_ids, dead_status)
+                return await orm_mailing_progress_save(
+                    session, mailing_id, cursor=cursor, sent=sent, failed=failed, status=status, owner=self.owner,
+                )
+
+        try:
+            mailing = await self._retry(mailing_id, 'загрузить задание', load)
+            cursor, sent, failed = mailing.cursor, mailing.sent, mailing.failed
+            sent_at_start = sent
+            try:
+                report = await self.bot.send_message(
+                    mailing.admin_chat_id,
+                    self._progress_text(mailing_id, sent, failed, mailing.total, 0.0),
+                )
+            except TelegramAPIError as e:
+                logger.warning('Не удалось отправить отчет о рассылке #%s: %s', mailing_id, e)
+
+            while True:
+                async def fetch():
+                    async with self.session_pool() as session:
+                        return await orm_ids_get_batch(session, after_id=cursor, limit=self.batch_size)
+
+                batch = await self._retry(mailing_id, 'получить получателей', fetch)
+                if not batch:
+                    break
+                results = await asyncio.gather(*(deliver(chat_id) for _, chat_id in batch))
+                cursor = batch[-1].id
+                dead: dict[str, list[int]] = {}
+                for (_, chat_id), result in zip(batch, results):
+                    if result == 'sent':
+                        sent += 1
+                        continue
+                    failed += 1
+                    if result != 'failed':
+                        dead.setdefault(result, []).append(chat_id)
+                # порция уже отправлена, поэтому повторяется только сохранение, а не доставка
+                if not await self._retry(mailing_id, 'сохранить прогресс', lambda: save(dead=dead)):
+                    logger.warning('Рассылку #%s занял другой процесс, останавливаемся на курсоре %s', mailing_id, cursor)
+                    return
+
+                if time.monotonic() - reported >= MAILING_REPORT_INTERVAL:
+                    speed = (sent - sent_at_start) / (time.monotonic() - started)
+                    await self._report(report, self._progress_text(mailing_id, sent, failed, mailing.total, speed))
+                    reported = time.monotonic()
+
+            await self._retry(mailing_id, 'завершить задание', lambda: save(status='done'))
+        except asyncio.CancelledError:
+            logger.info('Рассылка #%s остановлена на курсоре %s', mailing_id, cursor)
+            raise
+        except Exception:
+            logger.exception('Рассылка #%s прервана ошибкой на курсоре %s', mailing_id, cursor)
+            if mailing is None:
+                return
+            try:
+                await save(status='failed')
+            except Exception:
+                logger.exception('Не удалось пометить рассылку #%s как failed', mailing_id)
+            speed = (sent - sent_at_start) / max(time.monotonic() - started, 1e-9)
+            await self._report(report, self._progress_text(mailing_id, sent, failed, mailing.total, speed, title='прервана ошибкой'))
+            return
+
+        try:
+            async with self.session_pool() as session:
+                pruned = await orm_chats_prune_dead(session, MAILING_PRUNE_AFTER)
+            if pruned:
+                logger.info('Удалено недоступных чатов: %s', pruned)
+        except Exception:
+            logger.exception('Не удалось удалить недоступные чаты')
+        speed = (sent - sent_at_start) / max(time.monotonic() - started, 1e-9)
+        await self._report(report, self._progress_text(mailing_id, sent, failed, mailing.total, speed, title='завершена'))
+
+    async def _send(self, chat_id: int, text: str) -> str:
+        for _ in range(MAILING_RETRIES):
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return 'sent'
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError as e:
+                status = classify_send_error(e)
+                if status is None:
+                    logger.warning('Не удалось отправить рассылку в чат %s: %s', chat_id, e)
+                    return 'failed'
+                return status
+        return 'failed'
+
+    async def _report(self, report, text: str):
+        if report is None:
+            return
+        try:
+            await report.edit_text(text)
+        except TelegramAPIError as e:
+            logger.warning('Не удалось обновить отчет о рассылке: %s', e)
+
+    @staticmethod
+    def _progress_text(mailing_id: int, sent: int, failed: int, total: int, speed: float, title: str = 'идет'):
+        return (
+            f'Рассылка #{mailing_id} {title}\n'
+            f'Отправлено: {sent} из {total}\n'
+            f'Ошибок: {failed}\n'
+            f'Скорость: {speed:.1f} сообщ./сек'
+        )
@@ -0,0 +1,246 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 8080))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple, object] = {}
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self.values.get(key)
+        if child is None:
+            child = self.values[key] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in self.values.items():
+            yield f'{self.name}_total{_labels(self.labelnames, key)} {_number(child.value)}'
+
+
+class Gauge(Metric):
+    """
+    Gauge, значение которого можно задать вручную или вычислять при каждом сборе через callback,
+    возвращающий {значения меток: число}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), callback: Callable | None = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self):
+        if self.callback is not None:
+            for key, value in self.callback().items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+            return
+        for key, child in self.values.items():
+            yield f'{self.name}{_labels(self.labelnames, key)} {_number(child.value)}'
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                yield self._bucket(key, _number(float(bound)), cumulative)
+            yield self._bucket(key, '+Inf', child.count)
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(child.sum)}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {child.count}'
+
+    def _bucket(self, key: tuple, bound: str, count: int) -> str:
+        le = f'le="{bound}"'
+        return f'{self.name}_bucket{_labels(self.labelnames, key, le)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+updates = registry.register(Histogram(
+    'bot_update_duration_seconds', 'Время обработки апдейта целиком.', ['event_type'],
+))
+handlers = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время работы хендлера.', ['router', 'handler', 'level'],
+))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors', 'Исключения в хендлерах.', ['router', 'handler', 'level'],
+))
+db_queries = registry.register(Histogram(
+    'db_query_duration_seconds', 'Время выполнения SQL-запросов.', ['statement'],
+))
+db_errors = registry.register(Counter(
+    'db_query_errors', 'Ошибки SQL-запросов.', ['statement'],
+))
+telegram_requests = registry.register(Histogram(
+    'telegram_api_duration_seconds', 'Время запросов к Bot API.', ['method'],
+))
+telegram_errors = registry.register(Counter(
+    'telegram_api_errors', 'Ошибки запросов к Bot API.', ['method', 'error'],
+))
+
+
+def register_stats(name: str, documentation: str, stats: Callable[[], dict]):
+    """
+    Регистрирует gauge с меткой field, значения которого при каждом сборе берутся из stats().
+    """
+    registry.register(Gauge(
+        name, documentation, ['field'],
+        callback=lambda: {field: value for field, value in stats().items() if isinstance(value, (int, float))},
+    ))
+
+
+def _statement_kind(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return word if word in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH') else 'OTHER'
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_queries.labels(_statement_kind(statement)).observe(time.perf_counter() - context._metrics_started)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(context):
+        db_errors.labels(_statement_kind(context.statement or '')).inc()
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    async def metrics(request: web.Request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Метрики доступны на http://%s:%s/metrics', host, port)
+    return runner
@@ -1,4 +1,10 @@
 import math
+from typing import Hashable, Iterable
+
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.cache import QueryCache
 
 
 class Paginator:
@@ -38,4 +44,55 @@ class Paginator:
         if self.page > 1:
             self.page -= 1
             return self.__get_slice()
-        raise IndexError(f'Previous page does not exist. Use has_previous() to check before.')
\ No newline at end of file
+        raise IndexError(f'Previous page does not exist. Use has_previous() to check before.')
+
+class QueryPaginator:
+    def __init__(self, items: list, total: int, page: int=1, per_page: int=1):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.len = total
+        self.pages = math.ceil(self.len / self.per_page)
+
+    @classmethod
+    async def create(
+            cls,
+            session: AsyncSession,
+            query: Select,
+            page: int=1,
+            per_page: int=1,
+            cache: QueryCache | None = None,
+            cache_key: Hashable | None = None,
+            cache_tags: Iterable[str] = (),
+    ):
+        total = await cls.count(session, query, cache, cache_key, cache_tags)
+        start = (page - 1) * per_page
+        result = await session.execute(query.limit(per_page).offset(start))
+        return cls(result.scalars().all(), total, page=page, per_page=per_page)
+
+    @staticmethod
+    async def count(session: AsyncSession, query: Select, cache: QueryCache | None, cache_key: Hashable | None, cache_tags: Iterable[str]):
+        if cache is not None and cache_key is not None:
+            found, total = cache.get(('count', cache_key))
+            if found:
+                cache.hits += 1
+                return total
+            cache.misses += 1
+        version = cache.version if cache is not None else None
+        total = await session.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+        if cache is not None and cache_key is not None and version == cache.version:
+            cache.set(('count', cache_key), total, cache_tags)
+        return total
+
+    def get_page(self):
+        return self.items
+
+    def has_next(self):
+        if self.page < self.pages:
+            return self.page + 1
+        return False
+
+    def has_previous(self):
+        if self.page > 1:
+            return self.page - 1
+        return False